@@ -2,13 +2,22 @@
 # -*- coding: utf-8 -*-
 
 # import datetime
-# import hashlib
+import bisect
+import collections
+import functools
+import gzip
+import hashlib
 import inspect
+import io
 import json
 import os
+import random
 import re
+import socket
 import ssl
 import sys
+import threading
+import time
 from io import open
 
 import urllib2
@@ -23,6 +32,23 @@ try:
     from urllib.request import HTTPError, Request, urlopen  # Python >= 3.0
 except ImportError:
     from urllib2 import HTTPError, Request, urlopen  # Python == 2.x
+try:
+    import http.client as httplib  # Python >= 3.0
+    from urllib.parse import urljoin, urlsplit
+except ImportError:
+    import httplib  # Python == 2.x
+    from urlparse import urljoin, urlsplit
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+try:
+    from os import scandir  # Python >= 3.5
+except ImportError:
+    try:
+        from scandir import scandir  # Python == 2.x, if installed
+    except ImportError:
+        scandir = None
 # try:
 #     from urllib.parse import quote
 # except ImportError:
@@ -54,11 +80,68 @@ REF_AGENTS = ["com.plexapp.agents.localmedia"]
 LANGUAGES = [Locale.Language.NoLanguage, Locale.Language.English]  # type: ignore # noqa: F821, E501
 
 SSL_CONTEXT = ssl.SSLContext(SSL_PROTOCOL)
+CONNECTION_POOL = None
+DEFAULT_POOL_SIZE = 4
+MAX_REDIRECTS = 5
+RATE_LIMITER = None
+RATE_LIMITER_LOCK = threading.Lock()
+MIN_RATE_LIMIT = 1.0
+DEFAULT_MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+MAX_RETRY_BACKOFF = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+OVERLOAD_STATUSES = (429, 502, 503, 504)
+DEFAULT_TIMEOUTS = {"ping": 10, "metadata": 30, "image": 60}
+DEFAULT_UPDATE_DEADLINE = 0
+DEADLINE_CONTEXT = threading.local()
+METADATA_CACHE = None
+DEFAULT_CACHE_TTL = 86400
+DEFAULT_WORKERS = 4
+ARTWORK_CACHE = None
+ARTWORK_CACHE_LOCK = threading.Lock()
+DEFAULT_ARTWORK_CACHE_MB = 256
+DEFAULT_PING_TTL = 300
+DEFAULT_OFFLINE_BACKOFF = 60
+MAX_OFFLINE_BACKOFF = 900
+TA_SNAPSHOT = None
+SNAPSHOT_LOCK = threading.Lock()
+SNAPSHOT_NAME = "ta_snapshot.json.gz"
+LIBRARY_ROOTS_NAME = "ta_library_roots.json"
+LIBRARY_ROOTS_MTIME = None
+LIBRARY_ROOTS_LOCK = threading.Lock()
+CONNECTION_LOCK = threading.Lock()
+APPLIED_STORE = None
+APPLIED_STORE_LOCK = threading.Lock()
+SINGLE_FLIGHT = None
+SINGLE_FLIGHT_LOCK = threading.Lock()
+CHANNEL_CACHE = None
+CHANNEL_CACHE_LOCK = threading.Lock()
+DEFAULT_CHANNEL_CACHE_TTL = 300
+DEFAULT_CHANNEL_CACHE_SIZE = 256
+TA_STATS = None
+STATS_CONTEXT = threading.local()
+STATS_LOCK = threading.Lock()
+STATS_BUCKETS_MS = [10, 50, 100, 250, 500, 1000, 2500, 5000]
+CONNECTION_STATE = {
+    "online": False,
+    "version": [],
+    "checked_at": 0,
+    "retry_at": 0,
+    "failures": 0,
+}
 FILTER_CHARS = "\\/:*?<>|;"
-youtube_regexs = [
-    "[0-9]{8}_[a-zA-Z0-9]{11}_*.*",  # YYYYMMDD_XXXXXXXXXXX_TITLE.ext | Legacy TA title  # noqa: E501
-    "[a-zA-Z0-9]{11}.*",  # XXXXXXXXXXX.ext                | v0.4.0+
-]
+# YYYYMMDD_XXXXXXXXXXX_TITLE | Legacy TA title
+# XXXXXXXXXXX                | v0.4.0+
+TA_FILENAME_REGEX = re.compile(
+    "^(?:(?P<date>[0-9]{8})_(?P<legacy_ytid>[a-zA-Z0-9_-]{11})_*(?P<title>.*)"
+    "|(?P<ytid>[a-zA-Z0-9_-]{11}))$",
+    re.DOTALL,
+)
+LAYOUT_LEGACY = "legacy"
+LAYOUT_CURRENT = "current"
+FilenameMatch = collections.namedtuple(
+    "FilenameMatch", ["layout", "ytid", "date", "title"]
+)
 
 YOUTUBE_CATEGORY_ID = {
     "1": "Film & Animation",
@@ -197,6 +280,24 @@ def Dict(
     )
 
 
+def classify_filename(filename):
+    """Match a filename (without extension) against the TA layouts.
+
+    Returns a `FilenameMatch`, or None when the name follows neither layout.
+    """
+    match = TA_FILENAME_REGEX.match(filename)
+    if not match:
+        return None
+    if match.group("ytid"):
+        return FilenameMatch(LAYOUT_CURRENT, match.group("ytid"), None, None)
+    return FilenameMatch(
+        LAYOUT_LEGACY,
+        match.group("legacy_ytid"),
+        match.group("date"),
+        match.group("title"),
+    )
+
+
 def GetMediaDir(media, movie=False, file=False):
     if movie:
         return os.path.dirname(media.items[0].parts[0].file)
@@ -215,15 +316,572 @@ def GetMediaDir(media, movie=False, file=False):
             Log.Debug("Exception in GetMediaDir - seasons unhandled: {}".format(e))  # type: ignore # noqa: F821, E501
 
 
+def get_pref_int(key, default):
+    try:
+        return int(Prefs[key])  # type: ignore # noqa: F821
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+class TAStats(object):
+    """Call counts, bytes and latency histograms per request and phase kind.
+
+    Requests are keyed by TA endpoint (ping, video, channel, list, image).
+    Phases are the inclusive time spent in instrumented functions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}
+        self.phases = {}
+
+    def _add(self, table, kind, elapsed, size, error):
+        with self.lock:
+            entry = table.get(kind)
+            if entry is None:
+                entry = table[kind] = {
+                    "calls": 0,
+                    "errors": 0,
+                    "bytes": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "histogram": [0] * (len(STATS_BUCKETS_MS) + 1),
+                }
+            entry["calls"] += 1
+            entry["errors"] += 1 if error else 0
+            entry["bytes"] += size
+            entry["seconds"] += elapsed
+            entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+            entry["histogram"][
+                bisect.bisect_left(STATS_BUCKETS_MS, elapsed * 1000)
+            ] += 1
+
+    def record_request(self, kind, elapsed, size=0, error=False):
+        self._add(self.requests, kind, elapsed, size, error)
+
+    def record_phase(self, name, elapsed, error=False):
+        self._add(self.phases, name, elapsed, 0, error)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "elapsed": time.time() - self.started,
+                "buckets_ms": STATS_BUCKETS_MS,
+                "requests": json.loads(json.dumps(self.requests)),
+                "phases": json.loads(json.dumps(self.phases)),
+            }
+
+    def summary(self):
+        stats = self.as_dict()
+        parts = ["{:.2f}s".format(stats["elapsed"])]
+        for label, table in (
+            ("requests", stats["requests"]),
+            ("phases", stats["phases"]),
+        ):
+            items = [
+                "{} {}x{} {:.0f}ms avg {:.0f}ms max{}".format(
+                    kind,
+                    entry["calls"],
+                    " ({} failed)".format(entry["errors"])
+                    if entry["errors"]
+                    else "",
+                    entry["seconds"] * 1000 / entry["calls"],
+                    entry["max_seconds"] * 1000,
+                    " {}B".format(entry["bytes"]) if entry["bytes"] else "",
+                )
+                for kind, entry in sorted(table.items())
+            ]
+            parts.append("{}: {}".format(label, ", ".join(items) or "none"))
+        return " | ".join(parts)
+
+
+def get_ta_stats():
+    """Return the stats of the running `Update`, or the process-wide stats.
+
+    Plex runs several updates at once, so each one collects its own stats
+    on its thread, and `map_concurrently` hands them to its workers.
+    """
+    global TA_STATS
+    stats = getattr(STATS_CONTEXT, "stats", None)
+    if stats is not None:
+        return stats
+    with STATS_LOCK:
+        if TA_STATS is None:
+            TA_STATS = TAStats()
+    return TA_STATS
+
+
+def url_endpoint_kind(url):
+    """Classify a TA URL as ping, video, channel, list, image or other."""
+    parts = [part for part in urlsplit(url).path.split("/") if part]
+    if "cache" in parts:
+        return "image"
+    if "api" not in parts:
+        return "other"
+    parts = parts[parts.index("api") + 1 :]  # noqa: E203
+    if parts[:1] == ["ping"]:
+        return "ping"
+    if len(parts) == 1 or parts[-1:] == ["video"]:
+        return "list"
+    if len(parts) == 2 and parts[0] in ("video", "channel"):
+        return parts[0]
+    return "other"
+
+
+def timed_phase(name):
+    """Record the time spent in the decorated function as a phase."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                get_ta_stats().record_phase(name, time.time() - start, error)
+
+        return wrapper
+
+    return decorator
+
+
+def instrumented(call):
+    """Collect fresh stats for each call and log a one-line summary."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            STATS_CONTEXT.stats = TAStats()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                write_ta_stats(
+                    call, getattr(args[0], "id", "") if args else ""
+                )
+                STATS_CONTEXT.stats = None
+
+        return wrapper
+
+    return decorator
+
+
+def write_ta_stats(call, target):
+    stats = get_ta_stats()
+    Log.Info("{} stats for {}: {}".format(call, target, stats.summary()))  # type: ignore # noqa: F821, E501
+    stats_file = Prefs["tubearchivist_stats_file"]  # type: ignore # noqa: F821, E501
+    if not stats_file:
+        return
+    line = json.dumps(
+        {
+            "component": SOURCE,
+            "call": call,
+            "target": target,
+            "finished": time.time(),
+            "stats": stats.as_dict(),
+        }
+    )
+    try:
+        with STATS_LOCK:
+            with open(stats_file, "ab") as output:
+                output.write((line + "\n").encode("utf-8"))
+    except Exception as e:
+        Log.Error(  # type: ignore # noqa: F821
+            "Unable to write stats to '{}', Exception: '{}'".format(
+                stats_file, e
+            )
+        )
+
+
+class TAConnectionPool(object):
+    """Keep-alive HTTP(S) connections, pooled per scheme and host."""
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def acquire(self, scheme, netloc):
+        with self.lock:
+            idle = self.idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == "https":
+            return httplib.HTTPSConnection(netloc, context=SSL_CONTEXT), False
+        return httplib.HTTPConnection(netloc), False
+
+    def release(self, scheme, netloc, conn):
+        with self.lock:
+            idle = self.idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle = {}
+
+    def request(self, url, data=None, headers=None, method=None, timeout=None):
+        headers = headers or {}
+        method = method or ("GET" if data is None else "POST")
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            selector = parts.path or "/"
+            if parts.query:
+                selector = "{}?{}".format(selector, parts.query)
+            response, body = self._send(
+                parts.scheme,
+                parts.netloc,
+                method,
+                selector,
+                data,
+                headers,
+                timeout,
+            )
+            location = response.getheader("location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                if response.status not in (307, 308):
+                    method, data = "GET", None
+                continue
+            if response.status >= 400:
+                raise HTTPError(
+                    url,
+                    response.status,
+                    response.reason,
+                    response.msg,
+                    io.BytesIO(body),
+                )
+            return body
+        raise HTTPError(
+            url, response.status, "Too many redirects", response.msg, None
+        )
+
+    def _send(self, scheme, netloc, method, selector, data, headers, timeout):
+        conn, reused = self.acquire(scheme, netloc)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        try:
+            conn.request(method, selector, body=data, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except socket.timeout:
+            conn.close()
+            raise
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection, retry once.
+            return self._send(
+                scheme, netloc, method, selector, data, headers, timeout
+            )
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self.release(scheme, netloc, conn)
+        return response, body
+
+
+def get_connection_pool():
+    global CONNECTION_POOL
+    if CONNECTION_POOL is None:
+        CONNECTION_POOL = TAConnectionPool(
+            get_pref_int("tubearchivist_pool_size", DEFAULT_POOL_SIZE)
+        )
+    return CONNECTION_POOL
+
+
+class TARateLimiter(object):
+    """Adaptive token bucket shared by every TubeArchivist request.
+
+    Requests run unthrottled until TA signals overload (429, 502-504 or a
+    timeout). The rate then drops, at most once a second, to three quarters
+    of the throughput observed at that moment and climbs back by about one
+    request per second, every second, while responses stay clean and latency
+    stays near its best (AIMD). Once it passes the throughput that failed, the
+    throttle is lifted again. `limit` caps the rate in requests per second;
+    0 leaves it uncapped.
+    """
+
+    def __init__(self, limit=0):
+        self.lock = threading.Lock()
+        self.limit = float(limit)
+        self.rate = self.limit or None
+        self.ceiling = 0.0
+        self.tokens = 1.0
+        self.updated = time.time()
+        self.window_start = self.updated
+        self.window_count = 0
+        self.throughput = 0.0
+        self.latency = None
+        self.best_latency = None
+        self.decreased_at = 0
+
+    def acquire(self, max_wait=None):
+        """Wait for a token, or return False if it takes over `max_wait`."""
+        give_up_at = None if max_wait is None else time.time() + max_wait
+        while True:
+            with self.lock:
+                now = time.time()
+                if self.rate is not None:
+                    self.tokens = min(
+                        max(1.0, self.rate),
+                        self.tokens + (now - self.updated) * self.rate,
+                    )
+                    self.updated = now
+                if self.rate is None or self.tokens >= 1:
+                    if self.rate is not None:
+                        self.tokens -= 1
+                    self.window_count += 1
+                    if now - self.window_start >= 1:
+                        self.throughput = self.window_count / (
+                            now - self.window_start
+                        )
+                        self.window_start, self.window_count = now, 0
+                    return True
+                wait = (1 - self.tokens) / self.rate
+                if give_up_at is not None and now + wait > give_up_at:
+                    return False
+            time.sleep(wait)
+
+    def success(self, elapsed):
+        with self.lock:
+            self.latency = (
+                elapsed
+                if self.latency is None
+                else 0.8 * self.latency + 0.2 * elapsed
+            )
+            self.best_latency = min(
+                self.best_latency or self.latency, self.latency
+            )
+            if self.rate is None or self.latency > 2 * self.best_latency:
+                return
+            self.rate += 1.0 / self.rate
+            if self.limit:
+                self.rate = min(self.rate, self.limit)
+            elif self.rate > self.ceiling:
+                self.rate = None
+
+    def overloaded(self):
+        with self.lock:
+            now = time.time()
+            if now - self.decreased_at < 1:
+                return
+            self.decreased_at = now
+            current = self.window_count / max(
+                now - self.window_start, 1.0
+            )
+            observed = max(self.throughput, current, 1.0)
+            if self.rate is not None:
+                observed = min(observed, self.rate)
+            self.ceiling = max(self.ceiling, observed)
+            self.rate = max(MIN_RATE_LIMIT, observed * 0.75)
+            self.tokens = min(self.tokens, 1.0)
+
+
+def retry_delay(error, attempt):
+    """Return the back-off before retrying `error`, or None to give up."""
+    retry_after = 0
+    if isinstance(error, HTTPError):
+        if error.code not in RETRY_STATUSES:
+            return None
+        try:
+            retry_after = int(error.info().get("Retry-After") or 0)
+        except (AttributeError, TypeError, ValueError):
+            retry_after = 0
+    elif not isinstance(error, socket.timeout):
+        return None
+    delay = min(MAX_RETRY_BACKOFF, RETRY_BACKOFF * 2**attempt)
+    return min(
+        MAX_RETRY_BACKOFF,
+        max(retry_after, delay * random.uniform(0.5, 1.5)),
+    )
+
+
+def is_overload(error):
+    if isinstance(error, HTTPError):
+        return error.code in OVERLOAD_STATUSES
+    return isinstance(error, socket.timeout)
+
+
+def get_rate_limiter():
+    global RATE_LIMITER
+    with RATE_LIMITER_LOCK:
+        if RATE_LIMITER is None:
+            RATE_LIMITER = TARateLimiter(
+                get_pref_int("tubearchivist_rate_limit", 0)
+            )
+    return RATE_LIMITER
+
+
+class TADeadlineExceeded(Exception):
+    """The time allowed for the running `Update` has been used up."""
+
+
+def with_deadline(key, default):
+    """Bound the TA requests of each call by the `key` preference, in seconds.
+
+    The deadline is kept per thread and handed to the workers of
+    `map_concurrently`, like the stats of the call.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            seconds = get_pref_int(key, default)
+            DEADLINE_CONTEXT.deadline = (
+                time.time() + seconds if seconds > 0 else None
+            )
+            try:
+                return func(*args, **kwargs)
+            finally:
+                DEADLINE_CONTEXT.deadline = None
+
+        return wrapper
+
+    return decorator
+
+
+def deadline_remaining():
+    """Return the seconds left before the deadline, or None without one."""
+    deadline = getattr(DEADLINE_CONTEXT, "deadline", None)
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+def deadline_expired():
+    remaining = deadline_remaining()
+    return remaining is not None and remaining <= 0
+
+
+def without_deadline(func, *args):
+    """Call `func` with this thread's deadline lifted."""
+    deadline = getattr(DEADLINE_CONTEXT, "deadline", None)
+    DEADLINE_CONTEXT.deadline = None
+    try:
+        return func(*args)
+    finally:
+        DEADLINE_CONTEXT.deadline = deadline
+
+
+def request_timeout(kind):
+    """Return the socket timeout of a request, capped by the deadline."""
+    call_type = kind if kind in ("ping", "image") else "metadata"
+    timeout = get_pref_int(
+        "tubearchivist_{}_timeout".format(call_type),
+        DEFAULT_TIMEOUTS[call_type],
+    )
+    remaining = deadline_remaining()
+    if remaining is None:
+        return timeout if timeout > 0 else None
+    if remaining <= 0:
+        raise TADeadlineExceeded("Deadline reached before the request.")
+    return min(timeout, remaining) if timeout > 0 else remaining
+
+
+def request_with_retry(full_url, data, headers, method, kind):
+    """Send a TA request through the rate limiter, retrying transient errors.
+
+    429 and 5xx responses and timeouts are retried with jittered exponential
+    back-off, other errors are raised straight away. Every attempt gets the
+    timeout of its call type, and no attempt outlives the deadline.
+    """
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        if not limiter.acquire(deadline_remaining()):
+            raise TADeadlineExceeded(
+                "Deadline reached while waiting to request '{}'.".format(
+                    full_url
+                )
+            )
+        timeout = request_timeout(kind)
+        start = time.time()
+        try:
+            content = get_connection_pool().request(
+                full_url,
+                data=data,
+                headers=headers,
+                method=method,
+                timeout=timeout,
+            )
+            limiter.success(time.time() - start)
+            return content
+        except Exception as e:
+            delay = retry_delay(e, attempt)
+            if is_overload(e):
+                limiter.overloaded()
+            if delay is None or attempt >= get_pref_int(
+                "tubearchivist_max_retries", DEFAULT_MAX_RETRIES
+            ):
+                raise
+            remaining = deadline_remaining()
+            if remaining is not None and delay >= remaining:
+                raise TADeadlineExceeded(
+                    "Deadline reached while retrying '{}': {}".format(
+                        full_url, e
+                    )
+                )
+            get_ta_stats().record_request(
+                kind, time.time() - start, error=True
+            )
+            Log.Warning(  # type: ignore # noqa: F821
+                "Request to '{}' failed with '{}', retrying in {:.1f} seconds.".format(  # noqa: E501
+                    full_url, e, delay
+                )
+            )
+            time.sleep(delay)
+            attempt += 1
+
+
 def read_url(url, data=None):
     url_content = ""
+    kind = "other"
+    start = time.time()
     try:
-        if data is None:
-            url_content = urlopen(url, context=SSL_CONTEXT).read()
+        if isinstance(url, Request):
+            full_url = url.get_full_url()
+            headers = dict(url.header_items())
+            method = url.get_method()
+            if data is None:
+                data = url.data
+        else:
+            full_url, headers, method = url, {}, None
+        kind = url_endpoint_kind(full_url)
+        if full_url.split("://", 1)[0].lower() in ("http", "https"):
+            url_content = request_with_retry(
+                full_url, data, headers, method, kind
+            )
+        elif data is None:
+            url_content = urlopen(
+                url, context=SSL_CONTEXT, timeout=request_timeout(kind)
+            ).read()
         else:
-            url_content = urlopen(url, context=SSL_CONTEXT, data=data).read()
+            url_content = urlopen(
+                url,
+                context=SSL_CONTEXT,
+                data=data,
+                timeout=request_timeout(kind),
+            ).read()
+        get_ta_stats().record_request(
+            kind, time.time() - start, len(url_content)
+        )
         return url_content
     except Exception as e:
+        get_ta_stats().record_request(kind, time.time() - start, error=True)
         Log.Error(  # type: ignore # noqa: F821
             "Error reading or accessing url '%s', Exception: '%s'"
             % (
@@ -286,7 +944,7 @@ def read_file(localfile):
 def load_ta_config():
     global TA_CONFIG
     if TA_CONFIG:
-        TA_CONFIG["online"], TA_CONFIG["version"] = test_ta_connection()
+        refresh_ta_connection()
         return TA_CONFIG
     else:
         Log.Info(  # type: ignore # noqa: F821
@@ -309,7 +967,16 @@ def load_ta_config():
         TA_CONFIG.update(get_ta_config())
         TA_CONFIG["online"] = False
         TA_CONFIG["version"] = [0, 0, 0]
-        TA_CONFIG["online"], TA_CONFIG["version"] = test_ta_connection()
+        refresh_ta_connection()
+
+
+def refresh_ta_connection():
+    TA_CONFIG["online"], TA_CONFIG["version"] = check_ta_connection()
+    if use_ta_snapshot():
+        Log.Info(  # type: ignore # noqa: F821
+            "Using metadata from the local TubeArchivist snapshot."
+        )
+        TA_CONFIG["version"] = get_ta_snapshot()["version"]
 
 
 def get_ta_config():
@@ -325,6 +992,54 @@ def get_ta_config():
     return config_response
 
 
+def check_ta_connection():
+    """Return the last handshake result, only pinging TA once it expires.
+
+    A failed ping marks TA offline for a back-off window that doubles with
+    each consecutive failure, so items processed meanwhile are not re-probed.
+    """
+    with CONNECTION_LOCK:
+        state = CONNECTION_STATE
+        now = time.time()
+        if state["online"] and now - state["checked_at"] < get_pref_int(
+            "tubearchivist_ping_ttl", DEFAULT_PING_TTL
+        ):
+            return True, state["version"]
+        if not state["online"] and now < state["retry_at"]:
+            Log.Info(  # type: ignore # noqa: F821
+                "TubeArchivist was marked offline. Next connection check in {} seconds.".format(  # noqa: E501
+                    int(state["retry_at"] - now)
+                )
+            )
+            return False, state["version"]
+        if deadline_expired():
+            return state["online"], state["version"]
+        try:
+            online, version = test_ta_connection() or (False, [])
+        except Exception:
+            online, version = False, []
+        state["online"], state["version"] = online, version
+        state["checked_at"] = now
+        if online:
+            state["failures"], state["retry_at"] = 0, 0
+        else:
+            state["failures"] += 1
+            backoff = min(
+                get_pref_int(
+                    "tubearchivist_offline_backoff", DEFAULT_OFFLINE_BACKOFF
+                )
+                * 2 ** (state["failures"] - 1),
+                MAX_OFFLINE_BACKOFF,
+            )
+            state["retry_at"] = now + backoff
+            Log.Warning(  # type: ignore # noqa: F821
+                "TubeArchivist is not accessible. Treating it as offline for {} seconds.".format(  # noqa: E501
+                    backoff
+                )
+            )
+        return online, version
+
+
 def test_ta_connection(try_legacy_api=False):
     if not TA_CONFIG:
         return False, []
@@ -418,11 +1133,414 @@ def check_ta_version_in_response(response):
     return ta_version
 
 
+def get_snapshot_path():
+    return Prefs["tubearchivist_snapshot_path"] or os.path.join(  # type: ignore # noqa: F821, E501
+        CachePath, SNAPSHOT_NAME
+    )
+
+
+def read_ta_snapshot(filename):
+    snapshot = {"version": [], "channel": {}, "video": {}}
+    with gzip.open(filename, "rb") as lines:
+        for index, line in enumerate(lines):
+            item = json.loads(line.decode("utf-8"))
+            if index == 0:
+                snapshot["version"] = item["ta_version"]
+                continue
+            id_key = "youtube_id" if item["type"] == "video" else "channel_id"
+            snapshot[item["type"]][item["data"][id_key]] = item["data"]
+    return snapshot
+
+
+def get_ta_snapshot():
+    global TA_SNAPSHOT
+    with SNAPSHOT_LOCK:
+        if TA_SNAPSHOT is None:
+            TA_SNAPSHOT = {}
+            filename = get_snapshot_path()
+            if os.path.isfile(filename):
+                try:
+                    TA_SNAPSHOT = read_ta_snapshot(filename)
+                    Log.Info(  # type: ignore # noqa: F821
+                        "Loaded {} videos from TubeArchivist snapshot '{}'.".format(  # noqa: E501
+                            len(TA_SNAPSHOT["video"]), filename
+                        )
+                    )
+                except Exception as e:
+                    Log.Error(  # type: ignore # noqa: F821
+                        "Unable to read TubeArchivist snapshot '{}', Exception: '{}'".format(  # noqa: E501
+                            filename, e
+                        )
+                    )
+    return TA_SNAPSHOT
+
+
+def use_ta_snapshot():
+    if TA_CONFIG["online"] and not Prefs["tubearchivist_offline_mode"]:  # type: ignore # noqa: F821, E501
+        return False
+    return bool(get_ta_snapshot())
+
+
+def ta_metadata_available():
+    return TA_CONFIG["online"] or use_ta_snapshot()
+
+
+def get_ta_snapshot_metadata(id, mtype):
+    item = get_ta_snapshot()[mtype].get(id)
+    if item is None:
+        raise LookupError(
+            "YouTube {} {} is not in the TubeArchivist snapshot.".format(
+                mtype, id
+            )
+        )
+    Log.Info(  # type: ignore # noqa: F821
+        "Using snapshot metadata for YouTube {}: {}".format(mtype, id)
+    )
+    return {"data": item} if TA_CONFIG["version"] < [0, 5, 0] else item
+
+
+class TAMetadataCache(object):
+    """SQLite store of TubeArchivist API responses, shared with the scanner."""
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "mtype TEXT NOT NULL, id TEXT NOT NULL, ta_version TEXT, "
+                "refresh_date TEXT, expires_at INTEGER NOT NULL, "
+                "response TEXT NOT NULL, PRIMARY KEY (mtype, id))"
+            )
+            self.db.commit()
+
+    def get(self, mtype, id, version, stale=False):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT ta_version, expires_at, response FROM metadata "
+                "WHERE mtype = ? AND id = ?",
+                (mtype, id),
+            ).fetchone()
+        if not row or row[0] != version:
+            return None
+        if row[1] < time.time() and not stale:
+            return None
+        return json.loads(row[2])
+
+    def put(self, mtype, id, version, response):
+        self.put_many(mtype, version, [(id, response)])
+
+    def put_many(self, mtype, version, responses):
+        expires_at = int(time.time() + self.ttl)
+        rows = []
+        for id, response in responses:
+            data = response.get("data", response)
+            refresh_date = data.get("vid_last_refresh") or data.get(
+                "channel_last_refresh"
+            )
+            rows.append(
+                (
+                    mtype,
+                    id,
+                    version,
+                    refresh_date,
+                    expires_at,
+                    json.dumps(response),
+                )
+            )
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.db.commit()
+
+
+def get_metadata_cache():
+    global METADATA_CACHE
+    if METADATA_CACHE is None:
+        METADATA_CACHE = False
+        ttl = get_pref_int("tubearchivist_cache_ttl", DEFAULT_CACHE_TTL)
+        if sqlite3 is None or ttl <= 0:
+            Log.Info("TubeArchivist metadata cache is disabled.")  # type: ignore # noqa: F821, E501
+            return METADATA_CACHE
+        cache_file = os.path.join(CachePath, "ta_metadata_cache.db")
+        try:
+            METADATA_CACHE = TAMetadataCache(cache_file, ttl)
+        except Exception as e:
+            Log.Error(  # type: ignore # noqa: F821
+                "Unable to open TubeArchivist metadata cache '{}', Exception: '{}'".format(  # noqa: E501
+                    cache_file, e
+                )
+            )
+    return METADATA_CACHE
+
+
+def get_cached_ta_metadata(id, mtype, stale=False):
+    cache = get_metadata_cache()
+    if not cache:
+        return None
+    try:
+        return cache.get(mtype, id, ta_version_string(), stale)
+    except Exception as e:
+        Log.Error(  # type: ignore # noqa: F821
+            "Unable to read cached YouTube {} {}, Exception: '{}'".format(
+                mtype, id, e
+            )
+        )
+        return None
+
+
+def set_cached_ta_metadata(id, mtype, response):
+    cache = get_metadata_cache()
+    if not cache:
+        return
+    try:
+        cache.put(mtype, id, ta_version_string(), response)
+    except Exception as e:
+        Log.Error(  # type: ignore # noqa: F821
+            "Unable to cache YouTube {} {}, Exception: '{}'".format(
+                mtype, id, e
+            )
+        )
+
+
+class TAAppliedStore(object):
+    """SQLite record of the TA refresh date last applied to each item."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS applied ("
+                "guid TEXT NOT NULL, item TEXT NOT NULL, "
+                "signature TEXT NOT NULL, applied_at INTEGER NOT NULL, "
+                "PRIMARY KEY (guid, item))"
+            )
+            self.db.commit()
+
+    def load(self, guid):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT item, signature FROM applied WHERE guid = ?", (guid,)
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, guid, rows):
+        applied_at = int(time.time())
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO applied VALUES (?, ?, ?, ?)",
+                [
+                    (guid, item, signature, applied_at)
+                    for item, signature in rows
+                ],
+            )
+            self.db.commit()
+
+
+def get_applied_store():
+    global APPLIED_STORE
+    with APPLIED_STORE_LOCK:
+        if APPLIED_STORE is None:
+            APPLIED_STORE = False
+            if sqlite3 is None:
+                return APPLIED_STORE
+            store_file = os.path.join(CachePath, "ta_applied_refresh.db")
+            try:
+                APPLIED_STORE = TAAppliedStore(store_file)
+            except Exception as e:
+                Log.Error(  # type: ignore # noqa: F821
+                    "Unable to open applied refresh store '{}', Exception: '{}'".format(  # noqa: E501
+                        store_file, e
+                    )
+                )
+    return APPLIED_STORE
+
+
+def load_applied_refreshes(guid):
+    store = get_applied_store()
+    if not store:
+        return {}
+    try:
+        return store.load(guid)
+    except Exception as e:
+        Log.Error(  # type: ignore # noqa: F821
+            "Unable to read applied refreshes for {}, Exception: '{}'".format(
+                guid, e
+            )
+        )
+        return {}
+
+
+def save_applied_refreshes(guid, rows):
+    store = get_applied_store()
+    if not store or not rows:
+        return
+    try:
+        store.save(guid, rows)
+    except Exception as e:
+        Log.Error(  # type: ignore # noqa: F821
+            "Unable to record applied refreshes for {}, Exception: '{}'".format(  # noqa: E501
+                guid, e
+            )
+        )
+
+
+def applied_signature(refresh_date):
+    """Describe an applied refresh: TA's refresh date and display prefs."""
+    return "{}|{}|{}".format(
+        refresh_date,
+        Prefs["show_channel_id"],  # type: ignore # noqa: F821
+        Prefs["media_poster_source"],  # type: ignore # noqa: F821
+    )
+
+
+def ta_version_string():
+    return ".".join(str(x) for x in TA_CONFIG.get("version") or [])
+
+
+class TASingleFlight(object):
+    """Share one in-flight call between threads asking for the same key.
+
+    Plex runs several updates at once, and refreshes of the same channel
+    would otherwise each request its metadata and artwork. The first
+    caller runs the call, the others wait for and reuse its outcome.
+
+    Deadlines are per caller, so an outcome the leader reached after its
+    deadline passed, including `TADeadlineExceeded`, is not shared, and
+    a follower never waits past its own deadline. In both cases the
+    follower runs the call itself.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {
+                    "done": threading.Event(),
+                    "result": None,
+                    "error": None,
+                    "shared": False,
+                }
+        if not leader:
+            Log.Debug("Waiting for in-flight request: {}".format(key))  # type: ignore # noqa: F821, E501
+            remaining = deadline_remaining()
+            if (
+                call["done"].wait(
+                    None if remaining is None else max(remaining, 0)
+                )
+                and call["shared"]
+            ):
+                if call["error"] is not None:
+                    raise call["error"]
+                return call["result"]
+            return func(*args)
+        try:
+            call["result"] = func(*args)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            call["shared"] = not (
+                isinstance(call["error"], TADeadlineExceeded)
+                or deadline_expired()
+            )
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+
+def get_single_flight():
+    global SINGLE_FLIGHT
+    with SINGLE_FLIGHT_LOCK:
+        if SINGLE_FLIGHT is None:
+            SINGLE_FLIGHT = TASingleFlight()
+    return SINGLE_FLIGHT
+
+
+class TAMemoryCache(object):
+    """In-process mapping whose entries expire after `ttl` seconds.
+
+    Once `max_entries` is reached, the least recently used entry is
+    dropped to make room.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                return None
+            self.entries[key] = entry
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def get_channel_cache():
+    global CHANNEL_CACHE
+    with CHANNEL_CACHE_LOCK:
+        if CHANNEL_CACHE is None:
+            CHANNEL_CACHE = False
+            ttl = get_pref_int(
+                "tubearchivist_channel_cache_ttl", DEFAULT_CHANNEL_CACHE_TTL
+            )
+            if ttl <= 0:
+                Log.Info("TubeArchivist channel cache is disabled.")  # type: ignore # noqa: F821, E501
+                return CHANNEL_CACHE
+            CHANNEL_CACHE = TAMemoryCache(ttl, DEFAULT_CHANNEL_CACHE_SIZE)
+    return CHANNEL_CACHE
+
+
+@timed_phase("metadata")
 def get_ta_metadata(id, mtype="video"):
+    return get_single_flight().do(
+        ("metadata", mtype, id), request_ta_metadata, id, mtype
+    )
+
+
+def request_ta_metadata(id, mtype):
     request_url = ""
     request_url = "{}/api/{}/{}/".format(TA_CONFIG["ta_url"], mtype, id)
     if not TA_CONFIG:
         return {}
+    if use_ta_snapshot():
+        return get_ta_snapshot_metadata(id, mtype)
+    response = get_cached_ta_metadata(id, mtype)
+    if response:
+        Log.Info(  # type: ignore # noqa: F821
+            "Using cached response for YouTube {}: {}".format(mtype, id)
+        )
+        return response
+    if deadline_expired():
+        return get_fallback_ta_metadata(id, mtype)
     try:
         Log.Info(  # type: ignore # noqa: F821
             "Attempting to connect to TubeArchivist to lookup YouTube {}: {}".format(  # noqa: E501
@@ -441,8 +1559,11 @@ def get_ta_metadata(id, mtype="video"):
                 )
             )
         )
+        set_cached_ta_metadata(id, mtype, response)
         return response
     except Exception as e:
+        if isinstance(e, TADeadlineExceeded) or deadline_expired():
+            return get_fallback_ta_metadata(id, mtype)
         Log.Error(  # type: ignore # noqa: F821
             "Error connecting to TubeArchivist with URL '{}', Exception: '{}'".format(  # noqa: E501
                 request_url, e
@@ -451,6 +1572,28 @@ def get_ta_metadata(id, mtype="video"):
         raise e
 
 
+def get_fallback_ta_metadata(id, mtype):
+    """Return expired cached or snapshot metadata once the deadline is hit."""
+    response = get_cached_ta_metadata(id, mtype, stale=True)
+    if response:
+        Log.Warning(  # type: ignore # noqa: F821
+            "Deadline reached, using expired cached response for YouTube {}: {}".format(  # noqa: E501
+                mtype, id
+            )
+        )
+        return response
+    if get_ta_snapshot():
+        try:
+            return get_ta_snapshot_metadata(id, mtype)
+        except LookupError:
+            pass
+    raise TADeadlineExceeded(
+        "Deadline reached before YouTube {} {} was looked up.".format(
+            mtype, id
+        )
+    )
+
+
 def get_ta_video_metadata(ytid):
     mtype = "video"
     if not TA_CONFIG:
@@ -521,6 +1664,20 @@ def get_ta_channel_metadata(chid):
     if not chid:
         Log.Error("No {} ID present.".format(mtype))  # type: ignore # noqa: F821, E501
         return {}
+    # Plex refreshes a channel once per batch of new episodes, so repeated
+    # refreshes reuse the processed channel and the artwork keys built from
+    # it without reading the metadata cache or TubeArchivist.
+    cache = get_channel_cache()
+    cache_key = (chid, ta_version_string(), bool(Prefs["show_channel_id"]))  # type: ignore # noqa: F821, E501
+    if cache:
+        metadata = cache.get(cache_key)
+        if metadata is not None:
+            Log.Info(  # type: ignore # noqa: F821
+                "Using in-memory metadata for YouTube {}: {}".format(
+                    mtype, chid
+                )
+            )
+            return metadata
     try:
         ch_response = get_ta_metadata(chid, mtype="channel")
         Log.Info(  # type: ignore # noqa: F821
@@ -550,6 +1707,8 @@ def get_ta_channel_metadata(chid):
             metadata["banner_url"] = ch_response["channel_banner_url"]
             metadata["thumb_url"] = ch_response["channel_thumb_url"]
             metadata["tvart_url"] = ch_response["channel_tvart_url"]
+            if cache and not deadline_expired():
+                cache.put(cache_key, metadata)
             return metadata
         else:
             Log.Error(  # type: ignore # noqa: F821
@@ -564,7 +1723,261 @@ def get_ta_channel_metadata(chid):
         raise e
 
 
-def PullTASubtitles(vid_metadata, filepath, media_obj):  # noqa: C901
+def map_concurrently(func, items, workers=DEFAULT_WORKERS):
+    """Call `func` for every item on up to `workers` threads.
+
+    Results are returned in input order as `(result, exception)` pairs so the
+    caller can raise a failure where the serial loop would have hit it.
+    """
+    results = [(None, None)] * len(items)
+    indexes = iter(range(len(items)))
+    lock = threading.Lock()
+    stats = get_ta_stats()
+    deadline = getattr(DEADLINE_CONTEXT, "deadline", None)
+
+    def worker():
+        STATS_CONTEXT.stats = stats
+        DEADLINE_CONTEXT.deadline = deadline
+        while True:
+            with lock:
+                index = next(indexes, None)
+            if index is None:
+                return
+            try:
+                results[index] = (func(items[index]), None)
+            except Exception as e:
+                results[index] = (None, e)
+
+    threads = [
+        threading.Thread(target=worker)
+        for _ in range(max(1, min(workers, len(items))))
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def read_ta_artwork(url_path):
+    return read_url(
+        Request(
+            "{}{}".format(TA_CONFIG["ta_url"], url_path),
+            headers={
+                "Authorization": "Token {}".format(TA_CONFIG["ta_api_key"])
+            },
+        )
+    )
+
+
+def replace_file(source, target):
+    """Move `source` over `target` without a moment where it is missing."""
+    if hasattr(os, "replace"):
+        os.replace(source, target)  # Python >= 3.3
+        return
+    if os.name == "nt" and os.path.exists(target):
+        os.remove(target)  # os.rename cannot replace files on Windows
+    os.rename(source, target)
+
+
+class TAArtworkCache(object):
+    """Content-addressed image files, evicted least recently used first."""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        # Kept up to date by `put` and `evict`, so only a full cache is walked.
+        self.total = sum(size for _, size, _ in self.files())
+
+    def files(self):
+        """Yield `(mtime, size, filename)` for every stored image."""
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue  # another thread's image is still being written
+                filename = os.path.join(root, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, filename
+
+    def filename(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest)
+
+    def get(self, key):
+        filename = self.filename(key)
+        try:
+            with open(filename, "rb") as image:
+                data = image.read()
+            os.utime(filename, None)
+        except (IOError, OSError):
+            return None
+        return data
+
+    def put(self, key, data):
+        filename = self.filename(key)
+        folder = os.path.dirname(filename)
+        temp = "{}.{}.tmp".format(filename, threading.current_thread().ident)
+        with self.lock:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+        with open(temp, "wb") as image:
+            image.write(data)
+        replaced = 0
+        if os.path.exists(filename):
+            replaced = os.path.getsize(filename)
+        replace_file(temp, filename)
+        with self.lock:
+            self.total += len(data) - replaced
+
+    def evict(self):
+        with self.lock:
+            if self.total <= self.max_bytes:
+                return
+            files = sorted(self.files())
+            total = sum(size for _, size, _ in files)
+            for _, size, filename in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(filename)
+                    total -= size
+                except OSError:
+                    pass
+            self.total = total
+
+
+def get_artwork_cache():
+    global ARTWORK_CACHE
+    with ARTWORK_CACHE_LOCK:
+        if ARTWORK_CACHE is None:
+            ARTWORK_CACHE = False
+            size = get_pref_int(
+                "tubearchivist_artwork_cache_mb", DEFAULT_ARTWORK_CACHE_MB
+            )
+            if size <= 0:
+                Log.Info("TubeArchivist artwork cache is disabled.")  # type: ignore # noqa: F821, E501
+                return ARTWORK_CACHE
+            folder = os.path.join(CachePath, "artwork")
+            try:
+                ARTWORK_CACHE = TAArtworkCache(folder, size * 1024 * 1024)
+            except Exception as e:
+                Log.Error(  # type: ignore # noqa: F821
+                    "Unable to open TubeArchivist artwork cache '{}', Exception: '{}'".format(  # noqa: E501
+                        folder, e
+                    )
+                )
+    return ARTWORK_CACHE
+
+
+def fetch_ta_artwork(item):
+    """Return the image for a `(key, url_path)` pair, or None if offline.
+
+    The key is the refresh-date-prefixed proxy key used by `Update`, so a
+    channel or video refresh in TubeArchivist produces a new cache entry.
+    """
+    key, url_path = item
+    return get_single_flight().do(
+        ("artwork", key), load_ta_artwork, key, url_path
+    )
+
+
+def load_ta_artwork(key, url_path):
+    cache = get_artwork_cache()
+    if cache:
+        data = cache.get(key)
+        if data is not None:
+            return data
+    if not TA_CONFIG["online"] or deadline_expired():
+        return None
+    try:
+        data = read_ta_artwork(url_path)
+    except Exception as e:
+        if isinstance(e, TADeadlineExceeded) or deadline_expired():
+            return None
+        raise
+    if cache:
+        try:
+            cache.put(key, data)
+        except Exception as e:
+            Log.Error(  # type: ignore # noqa: F821
+                "Unable to cache TubeArchivist artwork '{}', Exception: '{}'".format(  # noqa: E501
+                    url_path, e
+                )
+            )
+    return data
+
+
+@timed_phase("artwork")
+def fetch_ta_artwork_batch(urls, workers=DEFAULT_WORKERS):
+    """Fetch `{key: url_path}` concurrently, returning `{key: (data, exc)}`."""
+    keys = list(urls.keys())
+    results = dict(
+        zip(
+            keys,
+            map_concurrently(
+                fetch_ta_artwork, [(key, urls[key]) for key in keys], workers
+            ),
+        )
+    )
+    cache = get_artwork_cache()
+    if cache and results:
+        try:
+            cache.evict()
+        except Exception as e:
+            Log.Error(  # type: ignore # noqa: F821
+                "Unable to trim TubeArchivist artwork cache, Exception: '{}'".format(  # noqa: E501
+                    e
+                )
+            )
+    return results
+
+
+def list_directory(folder):
+    """Return the file names in `folder`, or None if it cannot be read."""
+    try:
+        if scandir is not None:
+            return frozenset(entry.name for entry in scandir(folder))
+        return frozenset(os.listdir(folder))
+    except OSError:
+        return None
+
+
+class TADirectoryIndex(object):
+    """File names of each folder, read with one listing per folder.
+
+    `Update` keeps one index while it runs, so finding the subtitles of
+    every episode in a channel folder costs a single directory read
+    rather than a stat per subtitle, which adds up on network shares.
+    """
+
+    def __init__(self):
+        self.folders = {}
+
+    def names(self, folder):
+        if folder not in self.folders:
+            self.folders[folder] = list_directory(folder)
+        return self.folders[folder]
+
+    def contains(self, folder, filename):
+        if filename in self.names(folder):
+            return True
+        # Case-insensitive filesystems (macOS, Windows, SMB shares) list
+        # the name as stored, which can differ in case from TA's name.
+        return os.path.exists(os.path.join(folder, filename))
+
+
+@timed_phase("subtitles")
+def PullTASubtitles(  # noqa: C901
+    vid_metadata, filepath, media_obj, directory_index=None
+):
+    directory_index = directory_index or TADirectoryIndex()
     lang_sub_map = {}
     lang_pub_map = []
     languages = {}
@@ -582,11 +1995,12 @@ def PullTASubtitles(vid_metadata, filepath, media_obj):  # noqa: C901
             format = None
             lang_match = Locale.Language.Match(sub["lang"])  # type: ignore # noqa: F821, E501
 
-            if os.path.exists(filepath):
+            folder_names = directory_index.names(filepath)
+            if folder_names is not None:
                 filename = os.path.basename(sub["media_url"])
                 plex_sub_path = os.path.join(filepath, filename)
 
-                if os.path.exists(plex_sub_path):
+                if directory_index.contains(filepath, filename):
                     if not languages.has_key(lang_match):
                         languages[lang_match] = []
                     if "Default" in sub["name"]:
@@ -674,43 +2088,63 @@ def PullTASubtitles(vid_metadata, filepath, media_obj):  # noqa: C901
     #         Log.Debug("\nLANG({}): {}".format(language, DebugObject(part.subtitles[language])))  # noqa: E501
 
 
-def GetLibraryRootPath(dir):
-    library, root, path = "", "", ""
-    for root in [
-        os.sep.join(dir.split(os.sep)[0 : x + 2])  # noqa: E203
-        for x in range(0, dir.count(os.sep))
-    ]:
-        if root in PLEX_LIBRARY:
-            library = PLEX_LIBRARY[root]
-            path = os.path.relpath(dir, root)
-            break
-    else:  # 401 no right to list libraries (windows)
-        Log.Info("[X] Library access denied")  # type: ignore # noqa: F821
-        filename = os.path.join(CachePath, "_Logs", "_root_.scanner.log")
-        if os.path.isfile(filename):
+def load_library_roots():
+    """Fill `PLEX_LIBRARY` from the scanner's library root index.
+
+    The index is only read again once the scanner has rewritten it, so
+    repeated searches cost a single stat.
+    """
+    global LIBRARY_ROOTS_MTIME
+    filename = os.path.join(CachePath, LIBRARY_ROOTS_NAME)
+    with LIBRARY_ROOTS_LOCK:
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
             Log.Info(  # type: ignore # noqa: F821
-                '[_] TubeArchivist root scanner log file present: "{}"'.format(
+                '[!] TubeArchivist library root index missing: "{}"'.format(
                     filename
                 )
             )
-            line = Core.storage.load(  # type: ignore # noqa: F821
-                filename
-            )  # with open(filename, 'rb') as file:  line=file.read()
-            for root in [
-                os.sep.join(dir.split(os.sep)[0 : x + 2])  # noqa: E203
-                for x in range(dir.count(os.sep) - 1, -1, -1)
-            ]:
-                if "root: '{}'".format(root) in line:
-                    path = os.path.relpath(dir, root).rstrip(".")
-                    break  # Log.Info(u'[!] root not found: "{}"'.format(root))
-            else:
-                path, root = "_unknown_folder", ""
-        else:
-            Log.Info(  # type: ignore # noqa: F821
-                '[!] TubeArchivist root scanner log file missing: "{}"'.format(
-                    filename
+            return
+        if mtime == LIBRARY_ROOTS_MTIME:
+            return
+        try:
+            with open(filename, "rb") as index:
+                PLEX_LIBRARY.update(json.loads(index.read().decode("utf-8")))
+            LIBRARY_ROOTS_MTIME = mtime
+        except Exception as e:
+            Log.Error(  # type: ignore # noqa: F821
+                "Unable to read library root index '{}', Exception: '{}'".format(  # noqa: E501
+                    filename, e
                 )
             )
+
+
+def find_library_root(dir):
+    """Return the longest library root in `PLEX_LIBRARY` holding `dir`."""
+    root = dir.rstrip(os.sep)
+    while root:
+        if root in PLEX_LIBRARY:
+            return root
+        parent = os.path.dirname(root)
+        if parent == root:
+            break
+        root = parent
+    return ""
+
+
+def GetLibraryRootPath(dir):
+    library, root, path = "", "", ""
+    load_library_roots()
+    root = find_library_root(dir)
+    if root:
+        library = PLEX_LIBRARY[root]
+        path = os.path.relpath(dir, root)
+    else:
+        Log.Info(  # type: ignore # noqa: F821
+            '[!] No TubeArchivist library root recorded for "{}"'.format(dir)
+        )
+        path = "_unknown_folder"
     return library, root, path
 
 
@@ -797,6 +2231,8 @@ def Search(results, media, lang, manual):
     return 1
 
 
+@instrumented("Update")
+@with_deadline("tubearchivist_update_deadline", DEFAULT_UPDATE_DEADLINE)
 def Update(metadata, media, lang, force):  # noqa: C901
     _, guid, _ = metadata.id.split("|")  # Agent | GUID | Series Folder
     if not media:
@@ -807,7 +2243,7 @@ def Update(metadata, media, lang, force):  # noqa: C901
     channel_title = ""
     ch_metadata = {}
 
-    if TA_CONFIG["online"]:
+    if ta_metadata_available():
         try:
             ch_metadata = get_ta_channel_metadata(channel_id)
             channel_title = ch_metadata["show"]
@@ -823,110 +2259,90 @@ def Update(metadata, media, lang, force):  # noqa: C901
 
     metadata.title = channel_title
 
-    if TA_CONFIG["online"]:
+    if ta_metadata_available():
+        workers = get_pref_int("tubearchivist_workers", DEFAULT_WORKERS)
         thumb_channel = "{}_{}".format(
             ch_metadata["refresh_date"], ch_metadata["thumb_url"]
         )
-        if thumb_channel and thumb_channel not in metadata.posters:
-            metadata.posters[thumb_channel] = Proxy.Media(  # type: ignore # noqa: F821, E501
-                read_url(
-                    Request(
-                        "{}{}".format(
-                            TA_CONFIG["ta_url"], ch_metadata["thumb_url"]
-                        ),
-                        headers={
-                            "Authorization": "Token {}".format(
-                                TA_CONFIG["ta_api_key"]
-                            )
-                        },
-                    )
+        channel_artwork = [
+            ("Posters", metadata.posters, thumb_channel, "thumb_url"),
+            (
+                "Art",
+                metadata.art,
+                "{}_{}".format(
+                    ch_metadata["refresh_date"], ch_metadata["tvart_url"]
                 ),
-                sort_order=(
-                    1
-                    if Prefs["media_poster_source"] == "Channel"  # type: ignore # noqa: F821, E501
-                    else 2
+                "tvart_url",
+            ),
+            (
+                "Banners",
+                metadata.banners,
+                "{}_{}".format(
+                    ch_metadata["refresh_date"], ch_metadata["banner_url"]
                 ),
+                "banner_url",
+            ),
+        ]
+        applied = {} if force else load_applied_refreshes(metadata.id)
+        applied_rows = []
+        channel_signature = applied_signature(ch_metadata["refresh_date"])
+        if applied.get("") == channel_signature and all(
+            key in container for _, container, key, _ in channel_artwork
+        ):
+            Log.Info(  # type: ignore # noqa: F821
+                "Channel metadata for {} is unchanged since the last refresh.".format(  # noqa: E501
+                    channel_title
+                )
             )
-            Log("[X] Posters: {}".format(thumb_channel))  # type: ignore # noqa: F821, E501
-        elif thumb_channel and thumb_channel in metadata.posters:
-            Log("[_] Posters: {}".format(thumb_channel))  # type: ignore # noqa: F821, E501
         else:
-            Log("[ ] Posters: {}".format(thumb_channel))  # type: ignore # noqa: F821, E501
-
-        tvart_channel = "{}_{}".format(
-            ch_metadata["refresh_date"], ch_metadata["tvart_url"]
-        )
-        if tvart_channel and tvart_channel not in metadata.art:
-            metadata.art[tvart_channel] = Proxy.Media(  # type: ignore # noqa: F821, E501
-                read_url(
-                    Request(
-                        "{}{}".format(
-                            TA_CONFIG["ta_url"], ch_metadata["tvart_url"]
-                        ),
-                        headers={
-                            "Authorization": "Token {}".format(
-                                TA_CONFIG["ta_api_key"]
-                            )
-                        },
-                    )
-                ),
-                sort_order=(
-                    1
-                    if Prefs["media_poster_source"] == "Channel"  # type: ignore # noqa: F821, E501
-                    else 2
+            channel_results = fetch_ta_artwork_batch(
+                dict(
+                    (key, ch_metadata[url_field])
+                    for _, container, key, url_field in channel_artwork
+                    if key not in container
                 ),
+                workers,
             )
-            Log("[X] Art: {}".format(tvart_channel))  # type: ignore # noqa: F821, E501
-        elif tvart_channel and tvart_channel in metadata.art:
-            Log("[_] Art: {}".format(tvart_channel))  # type: ignore # noqa: F821, E501
-        else:
-            Log("[ ] Art: {}".format(tvart_channel))  # type: ignore # noqa: F821, E501
-
-        banner_channel = "{}_{}".format(
-            ch_metadata["refresh_date"], ch_metadata["banner_url"]
-        )
-        if banner_channel and banner_channel not in metadata.banners:
-            metadata.banners[banner_channel] = Proxy.Media(  # type: ignore # noqa: F821, E501
-                read_url(
-                    Request(
-                        "{}{}".format(
-                            TA_CONFIG["ta_url"], ch_metadata["banner_url"]
+            for label, container, key, _ in channel_artwork:
+                data, error = channel_results.get(key, (None, None))
+                if error:
+                    raise error
+                if data is not None:
+                    container[key] = Proxy.Media(  # type: ignore # noqa: F821
+                        data,
+                        sort_order=(
+                            1
+                            if Prefs["media_poster_source"] == "Channel"  # type: ignore # noqa: F821, E501
+                            else 2
                         ),
-                        headers={
-                            "Authorization": "Token {}".format(
-                                TA_CONFIG["ta_api_key"]
-                            )
-                        },
                     )
-                ),
-                sort_order=(
-                    1
-                    if Prefs["media_poster_source"] == "Channel"  # type: ignore # noqa: F821, E501
-                    else 2
-                ),
-            )
-            Log("[X] Banners: {}".format(banner_channel))  # type: ignore # noqa: F821, E501
-        elif banner_channel and banner_channel in metadata.banners:
-            Log("[_] Banners: {}".format(banner_channel))  # type: ignore # noqa: F821, E501
-        else:
-            Log("[ ] Banners: {}".format(banner_channel))  # type: ignore # noqa: F821, E501
+                    Log("[X] {}: {}".format(label, key))  # type: ignore # noqa: F821, E501
+                elif key and key in container:
+                    Log("[_] {}: {}".format(label, key))  # type: ignore # noqa: F821, E501
+                else:
+                    Log("[ ] {}: {}".format(label, key))  # type: ignore # noqa: F821, E501
 
-        metadata.roles.clear()
-        role = metadata.roles.new()
-        role.role = channel_title
-        role.name = channel_title
-        role.photo = thumb_channel
+            metadata.roles.clear()
+            role = metadata.roles.new()
+            role.role = channel_title
+            role.name = channel_title
+            role.photo = thumb_channel
 
-        metadata.summary = ch_metadata["description"]
-        metadata.studio = "YouTube"
+            metadata.summary = ch_metadata["description"]
+            metadata.studio = "YouTube"
 
-        Log.Info(  # type: ignore # noqa: F821
-            "Channel metadata updates completed for {}.".format(channel_title)
-        )
+            Log.Info(  # type: ignore # noqa: F821
+                "Channel metadata updates completed for {}.".format(
+                    channel_title
+                )
+            )
+            applied_rows.append(("", channel_signature))
 
         episodes = 0
 
         try:
+            pending = []
+            directory_index = TADirectoryIndex()
             for s in sorted(media.seasons, key=natural_sort_key):
                 for e in sorted(
                     media.seasons[s].episodes, key=natural_sort_key
@@ -948,94 +2364,165 @@ def Update(metadata, media, lang, force):  # noqa: C901
                             "TubeArchivist instance version is unknown or unset. Please review the logs further and ensure that there is connectivity between Plex and TubeArchivist."  # noqa: E501
                         )
                         break
-                    if (
+                    filename_match = classify_filename(filename_noext)
+                    if filename_match and ta_metadata_available():
+                        episode_id = filename_match.ytid
+                    elif (
                         TA_CONFIG["version"] > [0, 3, 6]
-                        and TA_CONFIG["online"]
+                        and ta_metadata_available()
                     ):
                         episode_id = filename_noext
-                    elif TA_CONFIG[
-                        "online"
-                    ]:  # Assume that if it is online and less that v0.4.0, it is compatible with the legacy file name schema  # noqa: E501
+                    elif (
+                        ta_metadata_available()
+                    ):  # Assume that if it is online and less that v0.4.0, it is compatible with the legacy file name schema  # noqa: E501
                         episode_id = filename[9:20]
 
-                    if TA_CONFIG["online"]:
-                        vid_metadata = get_ta_video_metadata(episode_id)
-                        episode.title = vid_metadata["title"]
-                        episode.summary = "Runtime: {}\nYouTube ID: {}{}\nVideo Title: {}\n{}".format(  # noqa: E501
-                            vid_metadata["runtime"],
-                            episode_id,
+                    if ta_metadata_available():
+                        pending.append(
                             (
-                                "\nVideo Type: {}".format(vid_metadata["type"])
-                                if "video" not in vid_metadata["type"]
-                                else ""
+                                episode,
+                                episode_media,
+                                episode_id,
+                                filepath,
+                                "{}/{}/{}".format(s, e, episode_id),
+                            )
+                        )
+
+            vid_results = map_concurrently(
+                get_ta_video_metadata,
+                [episode_id for _, _, episode_id, _, _ in pending],
+                workers,
+            )
+            late = [
+                index
+                for index, (_, vid_error) in enumerate(vid_results)
+                if isinstance(vid_error, TADeadlineExceeded)
+            ]
+            if late:
+                # Episodes are never skipped; those without cached or snapshot
+                # metadata are requested regardless of the deadline.
+                Log.Warning(  # type: ignore # noqa: F821
+                    "Deadline reached, requesting {} episodes for channel {} anyway.".format(  # noqa: E501
+                        len(late), channel_title
+                    )
+                )
+                for index, result in zip(
+                    late,
+                    without_deadline(
+                        map_concurrently,
+                        get_ta_video_metadata,
+                        [pending[index][2] for index in late],
+                        workers,
+                    ),
+                ):
+                    vid_results[index] = result
+            thumb_urls = {}
+            for (episode, _, _, _, item), (vid_metadata, _) in zip(
+                pending, vid_results
+            ):
+                try:
+                    thumb_vid = "{}_{}".format(
+                        vid_metadata["refresh_date"],
+                        vid_metadata["thumb_url"],
+                    )
+                    if thumb_vid not in episode.thumbs:
+                        thumb_urls[thumb_vid] = vid_metadata["thumb_url"]
+                except Exception:
+                    continue  # Raised again below, in episode order.
+            thumb_results = fetch_ta_artwork_batch(thumb_urls, workers)
+
+            for (episode, episode_media, episode_id, filepath, item), (
+                vid_metadata,
+                vid_error,
+            ) in zip(pending, vid_results):
+                if vid_error:
+                    raise vid_error
+                signature = applied_signature(vid_metadata["refresh_date"])
+                thumb_vid = "{}_{}".format(
+                    vid_metadata["refresh_date"], vid_metadata["thumb_url"]
+                )
+                if (
+                    applied.get(item) == signature
+                    and thumb_vid in episode.thumbs
+                ):
+                    Log.Info(  # type: ignore # noqa: F821
+                        "Episode '{}' for channel {} is unchanged since the last refresh.".format(  # noqa: E501
+                            episode_id, channel_title
+                        )
+                    )
+                    continue
+                episode.title = vid_metadata["title"]
+                episode.summary = "Runtime: {}\nYouTube ID: {}{}\nVideo Title: {}\n{}".format(  # noqa: E501
+                    vid_metadata["runtime"],
+                    episode_id,
+                    (
+                        "\nVideo Type: {}".format(vid_metadata["type"])
+                        if "video" not in vid_metadata["type"]
+                        else ""
+                    ),
+                    vid_metadata["title"],
+                    vid_metadata["description"],
+                )
+                episode.originally_available_at = vid_metadata[
+                    "processed_date"
+                ].date()
+
+                try:
+                    thumb_vid = "{}_{}".format(
+                        vid_metadata["refresh_date"],
+                        vid_metadata["thumb_url"],
+                    )
+                    thumb_data, thumb_error = thumb_results.get(
+                        thumb_vid, (None, None)
+                    )
+                    if thumb_error:
+                        raise thumb_error
+                    if thumb_data is not None:
+                        episode.thumbs[thumb_vid] = Proxy.Media(  # type: ignore # noqa: F821, E501
+                            thumb_data,
+                            sort_order=(
+                                1
+                                if Prefs["media_poster_source"] == "Channel"  # type: ignore # noqa: F821, E501
+                                else 2
                             ),
-                            vid_metadata["title"],
-                            vid_metadata["description"],
                         )
-                        episode.originally_available_at = vid_metadata[
-                            "processed_date"
-                        ].date()
-
-                        try:
-                            thumb_vid = "{}_{}".format(
-                                vid_metadata["refresh_date"],
-                                vid_metadata["thumb_url"],
-                            )
-                            if thumb_vid and thumb_vid not in episode.thumbs:
-                                episode.thumbs[thumb_vid] = Proxy.Media(  # type: ignore # noqa: F821, E501
-                                    read_url(
-                                        Request(
-                                            "{}{}".format(
-                                                TA_CONFIG["ta_url"],
-                                                vid_metadata["thumb_url"],
-                                            ),
-                                            headers={
-                                                "Authorization": "Token {}".format(  # noqa: E501
-                                                    TA_CONFIG["ta_api_key"]
-                                                )
-                                            },
-                                        )
-                                    ),
-                                    sort_order=(
-                                        1
-                                        if Prefs["media_poster_source"] == "Channel"  # type: ignore # noqa: F821, E501
-                                        else 2
-                                    ),
-                                )
-                                Log("[X] Thumbs: {}".format(thumb_vid))  # type: ignore # noqa: F821, E501
-                            elif thumb_vid and thumb_vid in episode.thumbs:
-                                Log("[_] Thumbs: {}".format(thumb_vid))  # type: ignore # noqa: F821, E501
-                            else:
-                                Log("[ ] Thumbs: {}".format(thumb_vid))  # type: ignore # noqa: F821, E501
-                        except Exception as ex:
-                            Log.Warning(  # type: ignore # noqa: F821, E501
-                                "Issue when handling thumbnails for {}. Issue: {}".format(  # noqa: E501
-                                    episode_id, ex
-                                )
-                            )
-                            raise ex
+                        Log("[X] Thumbs: {}".format(thumb_vid))  # type: ignore # noqa: F821, E501
+                    elif thumb_vid and thumb_vid in episode.thumbs:
+                        Log("[_] Thumbs: {}".format(thumb_vid))  # type: ignore # noqa: F821, E501
+                    else:
+                        Log("[ ] Thumbs: {}".format(thumb_vid))  # type: ignore # noqa: F821, E501
+                except Exception as ex:
+                    Log.Warning(  # type: ignore # noqa: F821, E501
+                        "Issue when handling thumbnails for {}. Issue: {}".format(  # noqa: E501
+                            episode_id, ex
+                        )
+                    )
+                    raise ex
 
-                        if vid_metadata["has_subtitles"]:
-                            PullTASubtitles(
-                                vid_metadata, filepath, episode_media
-                            )
-                        else:
-                            Log.Info(  # type: ignore # noqa: F821
-                                "No downloaded subtitles associated with video ID {}. No request made to TubeArchivist.".format(  # noqa: E501
-                                    episode_id
-                                )
-                            )
-                        Log.Info(  # type: ignore # noqa: F821
-                            "Episode '{} - {}' for channel {} processed successfully.".format(  # noqa: E501
-                                episode_id, episode.title, channel_title
-                            )
+                if vid_metadata["has_subtitles"]:
+                    PullTASubtitles(
+                        vid_metadata, filepath, episode_media, directory_index
+                    )
+                else:
+                    Log.Info(  # type: ignore # noqa: F821
+                        "No downloaded subtitles associated with video ID {}. No request made to TubeArchivist.".format(  # noqa: E501
+                            episode_id
                         )
+                    )
+                Log.Info(  # type: ignore # noqa: F821
+                    "Episode '{} - {}' for channel {} processed successfully.".format(  # noqa: E501
+                        episode_id, episode.title, channel_title
+                    )
+                )
+                applied_rows.append((item, signature))
         except AttributeError as ex:
             Log.Critical(  # type: ignore # noqa: F821
                 "Issue in processing media object. Missing object attribute. Full error: {}".format(  # noqa: E501
                     ex
                 )
             )
+        finally:
+            save_applied_refreshes(metadata.id, applied_rows)
         Log.Info(  # type: ignore # noqa: F821
             "All episode files processed for {}. Count: {}".format(
                 channel_title, str(episodes)
@@ -4,16 +4,28 @@
 Custom scanner plugin for Plex Media Server to integrate with TubeArchivist.
 """
 
+import atexit
+import bisect
+import calendar
+import codecs
+import collections
 import datetime
+import functools
+import gzip
 import inspect
+import io
 import json
 import logging
 import logging.handlers
 import os
 import os.path
+import random
 import re
+import socket
 import ssl
 import sys
+import threading
+import time
 
 import Media
 import Stack
@@ -22,6 +34,11 @@ import VideoFiles
 
 # from lxml import etree
 
+try:
+    import queue  # Python >= 3.0
+except ImportError:
+    import Queue as queue  # Python == 2.x
+
 try:
     from ssl import (
         PROTOCOL_TLS as SSL_PROTOCOL,  # Python >= 2.7.13 ##ssl.PROTOCOL_TLSv1
@@ -36,6 +53,16 @@ except ImportError:
     from urllib2 import HTTPError
     from urllib2 import Request as Request  # Python == 2.x
     from urllib2 import urlopen
+try:
+    import http.client as httplib  # Python >= 3.0
+    from urllib.parse import urljoin, urlsplit
+except ImportError:
+    import httplib  # Python == 2.x
+    from urlparse import urljoin, urlsplit
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 SetupDone = False
 Log = None
@@ -47,14 +74,99 @@ PLEX_LIBRARY_URL = "http://localhost:32400/library/sections/"
 SOURCE = "TubeArchivist Scanner"
 TA_CONFIG = None
 LOG_RETENTION = 5
+LOG_QUEUE_SIZE = 10000
+LOG_VERBOSITY_FILE = "file"
+LOG_VERBOSITY_FOLDER = "folder"
+LOG_VERBOSITY = LOG_VERBOSITY_FILE
+CONNECTION_POOL = None
+DEFAULT_POOL_SIZE = 4
+MAX_REDIRECTS = 5
+STREAM_CHUNK_SIZE = 65536
+RATE_LIMITER = None
+RATE_LIMITER_LOCK = threading.Lock()
+MIN_RATE_LIMIT = 1.0
+DEFAULT_MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+MAX_RETRY_BACKOFF = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+OVERLOAD_STATUSES = (429, 502, 503, 504)
+DEFAULT_TIMEOUTS = {"ping": 10, "metadata": 30}
+DEFAULT_SCAN_DEADLINE = 0
+DEFAULT_PREFETCH_MIN_FILES = 4
+LISTING_PAGE_SIZE = 12  # TubeArchivist's default page size
+DEADLINE = None
+METADATA_CACHE = None
+DEFAULT_CACHE_TTL = 86400
+DEFAULT_PING_TTL = 300
+DEFAULT_OFFLINE_BACKOFF = 60
+MAX_OFFLINE_BACKOFF = 900
+SCAN_MANIFEST = None
+DEFAULT_MANIFEST_TTL = 604800
+TA_SNAPSHOT = None
+SNAPSHOT_NAME = "ta_snapshot.json.gz"
+LIBRARY_ROOTS = None
+LIBRARY_ROOTS_NAME = "ta_library_roots.json"
+LIBRARY_ROOTS_LOCK_TIMEOUT = 10
+SNAPSHOT_FIELDS = {
+    "channel": {
+        "channel_id": None,
+        "channel_name": None,
+        "channel_last_refresh": None,
+        "channel_description": None,
+        "channel_banner_url": None,
+        "channel_thumb_url": None,
+        "channel_tvart_url": None,
+    },
+    "video": {
+        "youtube_id": None,
+        "title": None,
+        "published": None,
+        "vid_last_refresh": None,
+        "description": None,
+        "vid_thumb_url": None,
+        "vid_type": None,
+        "subtitles": None,
+        "player": ["duration_str"],
+        "channel": ["channel_id", "channel_name"],
+    },
+}
+# Channel listings keep the channel TA embeds in each video, for the agent.
+LISTING_FIELDS = dict(
+    SNAPSHOT_FIELDS["video"], channel=list(SNAPSHOT_FIELDS["channel"])
+)
+CONNECTION_STATE = {
+    "online": False,
+    "version": [],
+    "checked_at": 0,
+    "retry_at": 0,
+    "failures": 0,
+}
+TA_STATS = None
+STATS_BUCKETS_MS = [10, 50, 100, 250, 500, 1000, 2500, 5000]
+AGENT_DATA_LOCATION = os.path.join(
+    "Plug-in Support",
+    "Data",
+    "com.plexapp.agents.tubearchivist-agent",
+    "DataItems",
+)
 
 
 SSL_CONTEXT = ssl.SSLContext(SSL_PROTOCOL)
 FILTER_CHARS = "\\/:*?<>|;"
-TA_REGEXS = [
-    "[0-9]{8}_[a-zA-Z0-9_-]{11}_*.*",
-    "[a-zA-Z0-9_-]{11}.*",
-]
+# YYYYMMDD_XXXXXXXXXXX_TITLE | Legacy TA title
+# XXXXXXXXXXX                | v0.4.0+
+TA_FILENAME_REGEX = re.compile(
+    "^(?:(?P<date>[0-9]{8})_(?P<legacy_ytid>[a-zA-Z0-9_-]{11})_*(?P<title>.*)"
+    "|(?P<ytid>[a-zA-Z0-9_-]{11}))$",
+    re.DOTALL,
+)
+LAYOUT_LEGACY = "legacy"
+LAYOUT_CURRENT = "current"
+FilenameMatch = collections.namedtuple(
+    "FilenameMatch", ["layout", "ytid", "date", "title"]
+)
+CHANNEL_ID_REGEX = re.compile("UC[a-zA-Z0-9_-]{22}")
+INTERNED_STRINGS = {}
 
 
 def setup():
@@ -104,15 +216,606 @@ def setup():
         return True
 
 
+class TAStats(object):
+    """Call counts, bytes and latency histograms per request and phase kind.
+
+    Requests are keyed by TA endpoint (ping, video, channel, list, image).
+    Phases are the inclusive time spent in instrumented functions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}
+        self.phases = {}
+
+    def _add(self, table, kind, elapsed, size, error):
+        with self.lock:
+            entry = table.get(kind)
+            if entry is None:
+                entry = table[kind] = {
+                    "calls": 0,
+                    "errors": 0,
+                    "bytes": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "histogram": [0] * (len(STATS_BUCKETS_MS) + 1),
+                }
+            entry["calls"] += 1
+            entry["errors"] += 1 if error else 0
+            entry["bytes"] += size
+            entry["seconds"] += elapsed
+            entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+            entry["histogram"][
+                bisect.bisect_left(STATS_BUCKETS_MS, elapsed * 1000)
+            ] += 1
+
+    def record_request(self, kind, elapsed, size=0, error=False):
+        self._add(self.requests, kind, elapsed, size, error)
+
+    def record_phase(self, name, elapsed, error=False):
+        self._add(self.phases, name, elapsed, 0, error)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "elapsed": time.time() - self.started,
+                "buckets_ms": STATS_BUCKETS_MS,
+                "requests": json.loads(json.dumps(self.requests)),
+                "phases": json.loads(json.dumps(self.phases)),
+            }
+
+    def summary(self):
+        stats = self.as_dict()
+        parts = ["{:.2f}s".format(stats["elapsed"])]
+        for label, table in (
+            ("requests", stats["requests"]),
+            ("phases", stats["phases"]),
+        ):
+            items = [
+                "{} {}x{} {:.0f}ms avg {:.0f}ms max{}".format(
+                    kind,
+                    entry["calls"],
+                    " ({} failed)".format(entry["errors"])
+                    if entry["errors"]
+                    else "",
+                    entry["seconds"] * 1000 / entry["calls"],
+                    entry["max_seconds"] * 1000,
+                    " {}B".format(entry["bytes"]) if entry["bytes"] else "",
+                )
+                for kind, entry in sorted(table.items())
+            ]
+            parts.append("{}: {}".format(label, ", ".join(items) or "none"))
+        return " | ".join(parts)
+
+
+def get_ta_stats():
+    global TA_STATS
+    if TA_STATS is None:
+        TA_STATS = TAStats()
+    return TA_STATS
+
+
+def url_endpoint_kind(url):
+    """Classify a TA URL as ping, video, channel, list, image or other."""
+    parts = [part for part in urlsplit(url).path.split("/") if part]
+    if "cache" in parts:
+        return "image"
+    if "api" not in parts:
+        return "other"
+    parts = parts[parts.index("api") + 1 :]  # noqa: E203
+    if parts[:1] == ["ping"]:
+        return "ping"
+    if len(parts) == 1 or parts[-1:] == ["video"]:
+        return "list"
+    if len(parts) == 2 and parts[0] in ("video", "channel"):
+        return parts[0]
+    return "other"
+
+
+def timed_phase(name):
+    """Record the time spent in the decorated function as a phase."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            error = True
+            try:
+                result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                get_ta_stats().record_phase(name, time.time() - start, error)
+
+        return wrapper
+
+    return decorator
+
+
+def instrumented(call):
+    """Collect fresh stats for each call and log a one-line summary."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            global TA_STATS
+            TA_STATS = TAStats()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                write_ta_stats(call, args[0] if args else "")
+                flush_log()
+
+        return wrapper
+
+    return decorator
+
+
+def write_ta_stats(call, target):
+    stats = get_ta_stats()
+    if Log:
+        Log.info("{} stats for {}: {}".format(call, target, stats.summary()))
+    stats_file = Dict(TA_CONFIG, "ta_stats_file") if TA_CONFIG else ""
+    if not stats_file:
+        return
+    try:
+        with open(stats_file, "a") as output:
+            output.write(
+                json.dumps(
+                    {
+                        "component": SOURCE,
+                        "call": call,
+                        "target": target,
+                        "finished": time.time(),
+                        "stats": stats.as_dict(),
+                    }
+                )
+                + "\n"
+            )
+    except Exception as e:
+        Log.error(
+            "Unable to write stats to '{}', Exception: '{}'".format(
+                stats_file, e
+            )
+        )
+
+
+class TAConnectionPool(object):
+    """Keep-alive HTTP(S) connections, pooled per scheme and host."""
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def acquire(self, scheme, netloc):
+        with self.lock:
+            idle = self.idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == "https":
+            return httplib.HTTPSConnection(netloc, context=SSL_CONTEXT), False
+        return httplib.HTTPConnection(netloc), False
+
+    def release(self, scheme, netloc, conn):
+        with self.lock:
+            idle = self.idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle = {}
+
+    def request(
+        self,
+        url,
+        data=None,
+        headers=None,
+        method=None,
+        timeout=None,
+        stream=False,
+    ):
+        """Return the body of a request, or a `TAResponseStream` of it."""
+        headers = headers or {}
+        method = method or ("GET" if data is None else "POST")
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            selector = parts.path or "/"
+            if parts.query:
+                selector = "{}?{}".format(selector, parts.query)
+            response, body = self._send(
+                parts.scheme,
+                parts.netloc,
+                method,
+                selector,
+                data,
+                headers,
+                timeout,
+                stream,
+            )
+            location = response.getheader("location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                if response.status not in (307, 308):
+                    method, data = "GET", None
+                continue
+            if response.status >= 400:
+                raise HTTPError(
+                    url,
+                    response.status,
+                    response.reason,
+                    response.msg,
+                    io.BytesIO(body),
+                )
+            return body
+        raise HTTPError(
+            url, response.status, "Too many redirects", response.msg, None
+        )
+
+    def _send(
+        self,
+        scheme,
+        netloc,
+        method,
+        selector,
+        data,
+        headers,
+        timeout,
+        stream=False,
+    ):
+        conn, reused = self.acquire(scheme, netloc)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        try:
+            conn.request(method, selector, body=data, headers=headers)
+            response = conn.getresponse()
+            streamed = stream and 200 <= response.status < 300
+            body = None if streamed else response.read()
+        except socket.timeout:
+            conn.close()
+            raise
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection, retry once.
+            return self._send(
+                scheme,
+                netloc,
+                method,
+                selector,
+                data,
+                headers,
+                timeout,
+                stream,
+            )
+        except Exception:
+            conn.close()
+            raise
+        if streamed:
+            return response, TAResponseStream(
+                self, scheme, netloc, conn, response
+            )
+        if response.will_close:
+            conn.close()
+        else:
+            self.release(scheme, netloc, conn)
+        return response, body
+
+
+class TAResponseStream(object):
+    """Iterate over a pooled response body in chunks as it arrives.
+
+    The connection goes back to the pool once the body is read to the end,
+    and is closed if the reader stops early.
+    """
+
+    def __init__(self, pool, scheme, netloc, conn, response):
+        self.pool = pool
+        self.scheme = scheme
+        self.netloc = netloc
+        self.conn = conn
+        self.response = response
+        self.size = 0
+
+    def __iter__(self):
+        complete = False
+        try:
+            while True:
+                chunk = self.response.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.size += len(chunk)
+                yield chunk
+            complete = True
+        finally:
+            if complete and not self.response.will_close:
+                self.pool.release(self.scheme, self.netloc, self.conn)
+            else:
+                self.conn.close()
+
+
+def get_connection_pool():
+    global CONNECTION_POOL
+    if CONNECTION_POOL is None:
+        CONNECTION_POOL = TAConnectionPool(
+            int(Dict(TA_CONFIG, "ta_pool_size", default=DEFAULT_POOL_SIZE))
+        )
+    return CONNECTION_POOL
+
+
+class TARateLimiter(object):
+    """Adaptive token bucket shared by every TubeArchivist request.
+
+    Requests run unthrottled until TA signals overload (429, 502-504 or a
+    timeout). The rate then drops, at most once a second, to three quarters
+    of the throughput observed at that moment and climbs back by about one
+    request per second, every second, while responses stay clean and latency
+    stays near its best (AIMD). Once it passes the throughput that failed, the
+    throttle is lifted again. `limit` caps the rate in requests per second;
+    0 leaves it uncapped.
+    """
+
+    def __init__(self, limit=0):
+        self.lock = threading.Lock()
+        self.limit = float(limit)
+        self.rate = self.limit or None
+        self.ceiling = 0.0
+        self.tokens = 1.0
+        self.updated = time.time()
+        self.window_start = self.updated
+        self.window_count = 0
+        self.throughput = 0.0
+        self.latency = None
+        self.best_latency = None
+        self.decreased_at = 0
+
+    def acquire(self, max_wait=None):
+        """Wait for a token, or return False if it takes over `max_wait`."""
+        give_up_at = None if max_wait is None else time.time() + max_wait
+        while True:
+            with self.lock:
+                now = time.time()
+                if self.rate is not None:
+                    self.tokens = min(
+                        max(1.0, self.rate),
+                        self.tokens + (now - self.updated) * self.rate,
+                    )
+                    self.updated = now
+                if self.rate is None or self.tokens >= 1:
+                    if self.rate is not None:
+                        self.tokens -= 1
+                    self.window_count += 1
+                    if now - self.window_start >= 1:
+                        self.throughput = self.window_count / (
+                            now - self.window_start
+                        )
+                        self.window_start, self.window_count = now, 0
+                    return True
+                wait = (1 - self.tokens) / self.rate
+                if give_up_at is not None and now + wait > give_up_at:
+                    return False
+            time.sleep(wait)
+
+    def success(self, elapsed):
+        with self.lock:
+            self.latency = (
+                elapsed
+                if self.latency is None
+                else 0.8 * self.latency + 0.2 * elapsed
+            )
+            self.best_latency = min(
+                self.best_latency or self.latency, self.latency
+            )
+            if self.rate is None or self.latency > 2 * self.best_latency:
+                return
+            self.rate += 1.0 / self.rate
+            if self.limit:
+                self.rate = min(self.rate, self.limit)
+            elif self.rate > self.ceiling:
+                self.rate = None
+
+    def overloaded(self):
+        with self.lock:
+            now = time.time()
+            if now - self.decreased_at < 1:
+                return
+            self.decreased_at = now
+            current = self.window_count / max(
+                now - self.window_start, 1.0
+            )
+            observed = max(self.throughput, current, 1.0)
+            if self.rate is not None:
+                observed = min(observed, self.rate)
+            self.ceiling = max(self.ceiling, observed)
+            self.rate = max(MIN_RATE_LIMIT, observed * 0.75)
+            self.tokens = min(self.tokens, 1.0)
+
+
+def retry_delay(error, attempt):
+    """Return the back-off before retrying `error`, or None to give up."""
+    retry_after = 0
+    if isinstance(error, HTTPError):
+        if error.code not in RETRY_STATUSES:
+            return None
+        try:
+            retry_after = int(error.info().get("Retry-After") or 0)
+        except (AttributeError, TypeError, ValueError):
+            retry_after = 0
+    elif not isinstance(error, socket.timeout):
+        return None
+    delay = min(MAX_RETRY_BACKOFF, RETRY_BACKOFF * 2**attempt)
+    return min(
+        MAX_RETRY_BACKOFF,
+        max(retry_after, delay * random.uniform(0.5, 1.5)),
+    )
+
+
+def is_overload(error):
+    if isinstance(error, HTTPError):
+        return error.code in OVERLOAD_STATUSES
+    return isinstance(error, socket.timeout)
+
+
+def get_rate_limiter():
+    global RATE_LIMITER
+    with RATE_LIMITER_LOCK:
+        if RATE_LIMITER is None:
+            RATE_LIMITER = TARateLimiter(
+                float(Dict(TA_CONFIG, "ta_rate_limit", default=0))
+            )
+    return RATE_LIMITER
+
+
+class TADeadlineExceeded(Exception):
+    """The time allowed for the running `Scan` has been used up."""
+
+
+def start_deadline(seconds):
+    """Bound the TA requests of the running `Scan` to `seconds` from now."""
+    global DEADLINE
+    DEADLINE = time.time() + seconds if seconds > 0 else None
+
+
+def deadline_remaining():
+    """Return the seconds left before the deadline, or None without one."""
+    if DEADLINE is None:
+        return None
+    return DEADLINE - time.time()
+
+
+def deadline_expired():
+    remaining = deadline_remaining()
+    return remaining is not None and remaining <= 0
+
+
+def without_deadline(func, *args):
+    """Call `func` with the deadline lifted, for work that must not fail."""
+    global DEADLINE
+    deadline, DEADLINE = DEADLINE, None
+    try:
+        return func(*args)
+    finally:
+        DEADLINE = deadline
+
+
+def request_timeout(kind):
+    """Return the socket timeout of a request, capped by the deadline."""
+    call_type = "ping" if kind == "ping" else "metadata"
+    timeout = float(
+        Dict(
+            TA_CONFIG,
+            "ta_{}_timeout".format(call_type),
+            default=DEFAULT_TIMEOUTS[call_type],
+        )
+    )
+    remaining = deadline_remaining()
+    if remaining is None:
+        return timeout if timeout > 0 else None
+    if remaining <= 0:
+        raise TADeadlineExceeded("Deadline reached before the request.")
+    return min(timeout, remaining) if timeout > 0 else remaining
+
+
+def request_with_retry(full_url, data, headers, method, kind, stream=False):
+    """Send a TA request through the rate limiter, retrying transient errors.
+
+    429 and 5xx responses and timeouts are retried with jittered exponential
+    back-off, other errors are raised straight away. Every attempt gets the
+    timeout of its call type, and no attempt outlives the deadline.
+    """
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        if not limiter.acquire(deadline_remaining()):
+            raise TADeadlineExceeded(
+                "Deadline reached while waiting to request '{}'.".format(
+                    full_url
+                )
+            )
+        timeout = request_timeout(kind)
+        start = time.time()
+        try:
+            content = get_connection_pool().request(
+                full_url,
+                data=data,
+                headers=headers,
+                method=method,
+                timeout=timeout,
+                stream=stream,
+            )
+            limiter.success(time.time() - start)
+            return content
+        except Exception as e:
+            delay = retry_delay(e, attempt)
+            if is_overload(e):
+                limiter.overloaded()
+            if delay is None or attempt >= int(
+                Dict(TA_CONFIG, "ta_max_retries", default=DEFAULT_MAX_RETRIES)
+            ):
+                raise
+            remaining = deadline_remaining()
+            if remaining is not None and delay >= remaining:
+                raise TADeadlineExceeded(
+                    "Deadline reached while retrying '{}': {}".format(
+                        full_url, e
+                    )
+                )
+            get_ta_stats().record_request(
+                kind, time.time() - start, error=True
+            )
+            Log.warning(
+                "Request to '{}' failed with '{}', retrying in {:.1f} seconds.".format(  # noqa: E501
+                    full_url, e, delay
+                )
+            )
+            time.sleep(delay)
+            attempt += 1
+
+
 def read_url(url, data=None):
     url_content = ""
+    kind = "other"
+    start = time.time()
     try:
-        if data is None:
-            url_content = urlopen(url, context=SSL_CONTEXT).read()
+        if isinstance(url, Request):
+            full_url = url.get_full_url()
+            headers = dict(url.header_items())
+            method = url.get_method()
+            if data is None:
+                data = url.data
         else:
-            url_content = urlopen(url, context=SSL_CONTEXT, data=data).read()
+            full_url, headers, method = url, {}, None
+        kind = url_endpoint_kind(full_url)
+        if full_url.split("://", 1)[0].lower() in ("http", "https"):
+            url_content = request_with_retry(
+                full_url, data, headers, method, kind
+            )
+        elif data is None:
+            url_content = urlopen(
+                url, context=SSL_CONTEXT, timeout=request_timeout(kind)
+            ).read()
+        else:
+            url_content = urlopen(
+                url,
+                context=SSL_CONTEXT,
+                data=data,
+                timeout=request_timeout(kind),
+            ).read()
+        get_ta_stats().record_request(
+            kind, time.time() - start, len(url_content)
+        )
         return url_content
     except Exception as e:
+        get_ta_stats().record_request(kind, time.time() - start, error=True)
         Log.error(
             "Error reading or accessing url '%s', Exception: '%s'"
             % (
@@ -129,6 +832,30 @@ def read_url(url, data=None):
         raise e
 
 
+def stream_url(url):
+    """Yield the body of a TA GET request in chunks while it downloads."""
+    full_url = url.get_full_url()
+    if full_url.split("://", 1)[0].lower() not in ("http", "https"):
+        yield read_url(url)
+        return
+    kind = url_endpoint_kind(full_url)
+    start = time.time()
+    try:
+        body = request_with_retry(
+            full_url, None, dict(url.header_items()), "GET", kind, stream=True
+        )
+        for chunk in body:
+            yield chunk
+    except Exception as e:
+        get_ta_stats().record_request(kind, time.time() - start, error=True)
+        Log.error(
+            "Error reading or accessing url '%s', Exception: '%s'"
+            % (full_url, e)
+        )
+        raise
+    get_ta_stats().record_request(kind, time.time() - start, body.size)
+
+
 def read_file(localfile):
     file_content = ""
     try:
@@ -200,6 +927,92 @@ def set_logging(
     Log.addHandler(Handler)
 
 
+class TAQueueHandler(logging.Handler):
+    """Hand log records to a background thread that writes them to `target`.
+
+    Scanning threads only format the message and enqueue it, so rotation
+    checks and file writes no longer add to the time spent per file.
+    """
+
+    def __init__(self, target, max_size=LOG_QUEUE_SIZE):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = queue.Queue(max_size)
+        self.thread = threading.Thread(target=self.run, name="ta-log-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        try:
+            # Resolve the message now; its arguments may change before the
+            # writer thread gets to it.
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info
+                )
+                record.exc_info = None
+            self.queue.put(record)
+        except Exception:
+            self.handleError(record)
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                self.target.handle(record)
+            except Exception:
+                self.target.handleError(record)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        if self.thread.is_alive():
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.target.close()
+        logging.Handler.close(self)
+
+
+def configure_log_output():
+    """Apply the `ta_log_queue` and `ta_log_verbosity` settings."""
+    global Handler, LOG_VERBOSITY
+    LOG_VERBOSITY = Dict(
+        TA_CONFIG, "ta_log_verbosity", default=LOG_VERBOSITY_FILE
+    )
+    if (
+        not Handler
+        or isinstance(Handler, TAQueueHandler)
+        or not Dict(TA_CONFIG, "ta_log_queue", default=True)
+    ):
+        return
+    queued = TAQueueHandler(Handler)
+    queued.setLevel(Handler.level)
+    Log.addHandler(queued)
+    Log.removeHandler(Handler)
+    Handler = queued
+    atexit.register(queued.close)
+
+
+def flush_log():
+    if Handler:
+        Handler.flush()
+
+
+def log_file_info(message):
+    """Log a per-file line unless they are collapsed into folder summaries."""
+    if LOG_VERBOSITY != LOG_VERBOSITY_FOLDER:
+        Log.info(message)
+
+
 def Dict(var, *arg, **kwarg):
     for key in arg:
         if isinstance(var, dict) and key and key in var:
@@ -347,6 +1160,55 @@ def check_ta_version_in_response(response):
     return ta_version
 
 
+def check_ta_connection():
+    """Return the last handshake result, only pinging TA once it expires.
+
+    Plex calls `Scan()` once per folder within the same process, so this
+    keeps a library scan down to a single connection check.
+    """
+    state = CONNECTION_STATE
+    now = time.time()
+    if state["online"] and now - state["checked_at"] < int(
+        Dict(TA_CONFIG, "ta_ping_ttl", default=DEFAULT_PING_TTL)
+    ):
+        return True, state["version"]
+    if not state["online"] and now < state["retry_at"]:
+        Log.info(
+            "TubeArchivist was marked offline. Next connection check in {} seconds.".format(  # noqa: E501
+                int(state["retry_at"] - now)
+            )
+        )
+        return False, state["version"]
+    try:
+        online, version = test_ta_connection() or (False, [])
+    except Exception:
+        online, version = False, []
+    state["online"], state["version"] = online, version
+    state["checked_at"] = now
+    if online:
+        state["failures"], state["retry_at"] = 0, 0
+    else:
+        state["failures"] += 1
+        backoff = min(
+            int(
+                Dict(
+                    TA_CONFIG,
+                    "ta_offline_backoff",
+                    default=DEFAULT_OFFLINE_BACKOFF,
+                )
+            )
+            * 2 ** (state["failures"] - 1),
+            MAX_OFFLINE_BACKOFF,
+        )
+        state["retry_at"] = now + backoff
+        Log.warning(
+            "TubeArchivist is not accessible. Treating it as offline for {} seconds.".format(  # noqa: E501
+                backoff
+            )
+        )
+    return online, version
+
+
 def test_ta_connection(try_legacy_api=False):
     if not TA_CONFIG:
         return False, []
@@ -395,6 +1257,245 @@ def test_ta_connection(try_legacy_api=False):
         raise e
 
 
+class TAMetadataCache(object):
+    """SQLite store of TubeArchivist API responses, shared with the agent."""
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "mtype TEXT NOT NULL, id TEXT NOT NULL, ta_version TEXT, "
+                "refresh_date TEXT, expires_at INTEGER NOT NULL, "
+                "response TEXT NOT NULL, PRIMARY KEY (mtype, id))"
+            )
+            self.db.commit()
+
+    def get(self, mtype, id, version, stale=False):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT ta_version, expires_at, response FROM metadata "
+                "WHERE mtype = ? AND id = ?",
+                (mtype, id),
+            ).fetchone()
+        if not row or row[0] != version:
+            return None
+        if row[1] < time.time() and not stale:
+            return None
+        return json.loads(row[2])
+
+    def put(self, mtype, id, version, response):
+        self.put_many(mtype, version, [(id, response)])
+
+    def put_many(self, mtype, version, responses):
+        expires_at = int(time.time() + self.ttl)
+        rows = []
+        for id, response in responses:
+            data = response.get("data", response)
+            refresh_date = data.get("vid_last_refresh") or data.get(
+                "channel_last_refresh"
+            )
+            rows.append(
+                (
+                    mtype,
+                    id,
+                    version,
+                    refresh_date,
+                    expires_at,
+                    json.dumps(response),
+                )
+            )
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.db.commit()
+
+
+def get_metadata_cache():
+    global METADATA_CACHE
+    if METADATA_CACHE is None:
+        METADATA_CACHE = False
+        ttl = int(Dict(TA_CONFIG, "ta_cache_ttl", default=DEFAULT_CACHE_TTL))
+        if sqlite3 is None or ttl <= 0:
+            Log.info("TubeArchivist metadata cache is disabled.")
+            return METADATA_CACHE
+        cache_file = os.path.join(
+            PLEX_ROOT, AGENT_DATA_LOCATION, "ta_metadata_cache.db"
+        )
+        try:
+            METADATA_CACHE = TAMetadataCache(cache_file, ttl)
+        except Exception as e:
+            Log.error(
+                "Unable to open TubeArchivist metadata cache '{}', Exception: '{}'".format(  # noqa: E501
+                    cache_file, e
+                )
+            )
+    return METADATA_CACHE
+
+
+def get_cached_ta_metadata(id, mtype, stale=False):
+    cache = get_metadata_cache()
+    if not cache:
+        return None
+    try:
+        return cache.get(mtype, id, ta_version_string(), stale)
+    except Exception as e:
+        Log.error(
+            "Unable to read cached YouTube {} {}, Exception: '{}'".format(
+                mtype, id, e
+            )
+        )
+        return None
+
+
+def set_cached_ta_metadata(id, mtype, response):
+    cache = get_metadata_cache()
+    if not cache:
+        return
+    try:
+        cache.put(mtype, id, ta_version_string(), response)
+    except Exception as e:
+        Log.error(
+            "Unable to cache YouTube {} {}, Exception: '{}'".format(
+                mtype, id, e
+            )
+        )
+
+
+def ta_version_string():
+    return ".".join(str(x) for x in Dict(TA_CONFIG, "version", default=[]))
+
+
+def get_snapshot_path():
+    return Dict(
+        TA_CONFIG,
+        "ta_snapshot_path",
+        default=os.path.join(PLEX_ROOT, AGENT_DATA_LOCATION, SNAPSHOT_NAME),
+    )
+
+
+def compact_snapshot_item(item, fields):
+    compact = {}
+    for key, subkeys in fields.items():
+        if key not in item:
+            continue
+        if subkeys:
+            compact[key] = dict(
+                (subkey, item[key][subkey])
+                for subkey in subkeys
+                if subkey in item[key]
+            )
+        else:
+            compact[key] = item[key]
+    return compact
+
+
+def export_ta_snapshot(filename):
+    """Write every TA channel and video to a gzipped JSON lines snapshot."""
+    counts = {}
+    folder = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    temp_filename = "{}.tmp".format(filename)
+    with gzip.open(temp_filename, "wb") as snapshot:
+        header = {"ta_version": TA_CONFIG["version"], "exported": time.time()}
+        snapshot.write((json.dumps(header) + "\n").encode("utf-8"))
+        for mtype in ("channel", "video"):
+            counts[mtype] = 0
+            request_url = "{}/api/{}/".format(TA_CONFIG["ta_url"], mtype)
+            for items in iter_ta_list_pages(
+                request_url, SNAPSHOT_FIELDS[mtype]
+            ):
+                for item in items:
+                    line = json.dumps(
+                        {"type": mtype, "data": item},
+                        separators=(",", ":"),
+                    )
+                    snapshot.write((line + "\n").encode("utf-8"))
+                    counts[mtype] += 1
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temp_filename, filename)
+    Log.info(
+        "Exported {} channels and {} videos to TubeArchivist snapshot '{}'.".format(  # noqa: E501
+            counts["channel"], counts["video"], filename
+        )
+    )
+    return counts
+
+
+def read_ta_snapshot(filename):
+    snapshot = {"version": [], "channel": {}, "video": {}}
+    with gzip.open(filename, "rb") as lines:
+        for index, line in enumerate(lines):
+            item = json.loads(line.decode("utf-8"))
+            if index == 0:
+                snapshot["version"] = item["ta_version"]
+                continue
+            id_key = "youtube_id" if item["type"] == "video" else "channel_id"
+            snapshot[item["type"]][item["data"][id_key]] = item["data"]
+    return snapshot
+
+
+def get_ta_snapshot():
+    global TA_SNAPSHOT
+    if TA_SNAPSHOT is None:
+        TA_SNAPSHOT = {}
+        filename = get_snapshot_path()
+        if os.path.isfile(filename):
+            try:
+                TA_SNAPSHOT = read_ta_snapshot(filename)
+                Log.info(
+                    "Loaded {} videos from TubeArchivist snapshot '{}'.".format(  # noqa: E501
+                        len(TA_SNAPSHOT["video"]), filename
+                    )
+                )
+            except Exception as e:
+                Log.error(
+                    "Unable to read TubeArchivist snapshot '{}', Exception: '{}'".format(  # noqa: E501
+                        filename, e
+                    )
+                )
+    return TA_SNAPSHOT
+
+
+def use_ta_snapshot():
+    if TA_CONFIG["online"] and not Dict(
+        TA_CONFIG, "ta_offline_mode", default=False
+    ):
+        return False
+    return bool(get_ta_snapshot())
+
+
+def get_ta_snapshot_metadata(id, mtype):
+    item = get_ta_snapshot()[mtype].get(id)
+    if item is None:
+        raise LookupError(
+            "YouTube {} {} is not in the TubeArchivist snapshot.".format(
+                mtype, id
+            )
+        )
+    log_file_info(
+        "Using snapshot metadata for YouTube {}: {}".format(mtype, id)
+    )
+    return {"data": item} if TA_CONFIG["version"] < [0, 5, 0] else item
+
+
+def ta_api_request(request_url):
+    return Request(
+        request_url,
+        headers={"Authorization": "Token {}".format(TA_CONFIG["ta_api_key"])},
+    )
+
+
+@timed_phase("metadata")
 def get_ta_metadata(id, mtype="video"):
     request_url = ""
     # Currently, the API endpoint is identical. However, we should have this here for a future version in case the API changes.  # noqa: E501
@@ -405,8 +1506,18 @@ def get_ta_metadata(id, mtype="video"):
     request_url = "{}/api/{}/{}/".format(TA_CONFIG["ta_url"], mtype, id)
     if not TA_CONFIG:
         return None
+    if use_ta_snapshot():
+        return get_ta_snapshot_metadata(id, mtype)
+    response = get_cached_ta_metadata(id, mtype)
+    if response:
+        log_file_info(
+            "Using cached response for YouTube {}: {}".format(mtype, id)
+        )
+        return response
+    if deadline_expired():
+        return get_fallback_ta_metadata(id, mtype)
     try:
-        Log.info(
+        log_file_info(
             "Attempting to connect to TubeArchivist to lookup YouTube {}: {}".format(  # noqa: E501
                 mtype, id
             )
@@ -423,8 +1534,11 @@ def get_ta_metadata(id, mtype="video"):
                 )
             )
         )
+        set_cached_ta_metadata(id, mtype, response)
         return response
     except Exception as e:
+        if isinstance(e, TADeadlineExceeded) or deadline_expired():
+            return get_fallback_ta_metadata(id, mtype)
         Log.error(
             "Error connecting to TubeArchivist with URL '{}', Exception: '{}'".format(  # noqa: E501
                 request_url, e
@@ -433,6 +1547,28 @@ def get_ta_metadata(id, mtype="video"):
         raise e
 
 
+def get_fallback_ta_metadata(id, mtype):
+    """Return expired cached or snapshot metadata once the deadline is hit."""
+    response = get_cached_ta_metadata(id, mtype, stale=True)
+    if response:
+        Log.warning(
+            "Deadline reached, using expired cached response for YouTube {}: {}".format(  # noqa: E501
+                mtype, id
+            )
+        )
+        return response
+    if get_ta_snapshot():
+        try:
+            return get_ta_snapshot_metadata(id, mtype)
+        except LookupError:
+            pass
+    raise TADeadlineExceeded(
+        "Deadline reached before YouTube {} {} was looked up.".format(
+            mtype, id
+        )
+    )
+
+
 def get_ta_video_metadata(ytid):
     mtype = "video"
     if not TA_CONFIG:
@@ -443,7 +1579,7 @@ def get_ta_video_metadata(ytid):
         return None
     try:
         vid_response = get_ta_metadata(ytid)
-        Log.info(
+        log_file_info(
             "Response from TubeArchivist received for YouTube {}: {}".format(
                 mtype, ytid
             )
@@ -454,42 +1590,7 @@ def get_ta_video_metadata(ytid):
                     "Processing response with pre-v0.5.0 TA API response format."  # noqa: E501
                 )
                 vid_response = vid_response["data"]
-            metadata = {}
-            metadata["show"] = "{} [{}]".format(
-                vid_response["channel"]["channel_name"],
-                vid_response["channel"]["channel_id"],
-            )
-            metadata["ytid"] = vid_response["youtube_id"]
-            metadata["title"] = vid_response["title"]
-            if TA_CONFIG["version"] < [0, 3, 7]:
-                Log.debug(
-                    "Processing response with initial TA API response format."
-                )
-                metadata["processed_date"] = datetime.datetime.strptime(
-                    vid_response["published"], "%d %b, %Y"
-                )
-                video_refresh = datetime.datetime.strptime(
-                    vid_response["vid_last_refresh"], "%d %b, %Y"
-                )
-            else:
-                metadata["processed_date"] = datetime.datetime.strptime(
-                    vid_response["published"], "%Y-%m-%d"
-                )
-                video_refresh = datetime.datetime.strptime(
-                    vid_response["vid_last_refresh"], "%Y-%m-%d"
-                )
-            metadata["refresh_date"] = video_refresh.strftime("%Y%m%d")
-            metadata["season"] = metadata["processed_date"].year
-            metadata["episode"] = metadata["processed_date"].strftime("%Y%m%d")
-            metadata["description"] = vid_response["description"]
-            metadata["thumb_url"] = vid_response["vid_thumb_url"]
-            metadata["type"] = vid_response["vid_type"]
-            metadata["has_subtitles"] = (
-                True if "subtitles" in vid_response else False
-            )
-            if metadata["has_subtitles"]:
-                metadata["subtitle_metadata"] = vid_response["subtitles"]
-            return metadata
+            return process_ta_video_response(vid_response)
         else:
             Log.error(
                 "Empty response returned from %s when requesting data about %s."  # noqa: E501
@@ -503,6 +1604,352 @@ def get_ta_video_metadata(ytid):
         raise e
 
 
+def intern_string(value):
+    """Share one copy of strings repeated across videos, e.g. channel names.
+
+    `intern()` only takes byte strings on Python 2, hence the table.
+    """
+    return INTERNED_STRINGS.setdefault(value, value)
+
+
+def epoch_seconds(date):
+    return calendar.timegm(date.timetuple())
+
+
+class TAVideoRecord(object):
+    """Compact form of a processed TA video, as kept in the scan lookups.
+
+    Strings shared between videos are interned and dates are kept as epoch
+    seconds. The description, thumbnail and subtitle list are left out and
+    looked up again (normally from the metadata cache) only when accessed.
+    `record["key"]` reads the keys of the dict this record replaces.
+    """
+
+    __slots__ = (
+        "ytid",
+        "channel_id",
+        "show",
+        "title",
+        "type",
+        "published",
+        "refreshed",
+        "has_subtitles",
+    )
+
+    def __init__(self, vid_response, published, refreshed):
+        channel = vid_response["channel"]
+        self.ytid = vid_response["youtube_id"]
+        self.channel_id = intern_string(channel["channel_id"])
+        self.show = intern_string(
+            "{} [{}]".format(channel["channel_name"], channel["channel_id"])
+        )
+        self.title = vid_response["title"]
+        self.type = intern_string(vid_response["vid_type"])
+        self.published = published
+        self.refreshed = refreshed
+        self.has_subtitles = "subtitles" in vid_response
+
+    def __getitem__(self, key):
+        if key not in self.__slots__ and not isinstance(
+            getattr(TAVideoRecord, key, None), property
+        ):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self):
+        return "<TAVideoRecord {} {!r}>".format(self.ytid, self.title)
+
+    def document(self):
+        response = get_ta_metadata(self.ytid)
+        if TA_CONFIG["version"] < [0, 5, 0]:
+            response = response["data"]
+        return response
+
+    @property
+    def processed_date(self):
+        return datetime.datetime.utcfromtimestamp(self.published)
+
+    @property
+    def refresh_date(self):
+        return datetime.datetime.utcfromtimestamp(self.refreshed).strftime(
+            "%Y%m%d"
+        )
+
+    @property
+    def season(self):
+        return self.processed_date.year
+
+    @property
+    def episode(self):
+        return self.processed_date.strftime("%Y%m%d")
+
+    @property
+    def description(self):
+        return self.document()["description"]
+
+    @property
+    def thumb_url(self):
+        return self.document()["vid_thumb_url"]
+
+    @property
+    def subtitle_metadata(self):
+        return self.document()["subtitles"]
+
+
+def process_ta_video_response(vid_response):
+    if TA_CONFIG["version"] < [0, 3, 7]:
+        Log.debug("Processing response with initial TA API response format.")
+        date_format = "%d %b, %Y"
+    else:
+        date_format = "%Y-%m-%d"
+    return TAVideoRecord(
+        vid_response,
+        epoch_seconds(
+            datetime.datetime.strptime(vid_response["published"], date_format)
+        ),
+        epoch_seconds(
+            datetime.datetime.strptime(
+                vid_response["vid_last_refresh"], date_format
+            )
+        ),
+    )
+
+
+class TAJSONListReader(object):
+    """Decode the items of a streamed TA list response one at a time.
+
+    The body is either a bare list or an object whose `data` key holds the
+    list; the object's other keys, such as `paginate`, end up in `extra`.
+    Only the item being decoded and the unread part of the current chunk
+    are held in memory.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.extra = {}
+
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        self.eof = chunk is None
+        self.buffer = self.buffer[self.pos :] + self.text.decode(  # noqa: E203
+            chunk or b"", final=self.eof
+        )
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character, or "" at the end."""
+        while True:
+            while (
+                self.pos < len(self.buffer)
+                and self.buffer[self.pos] in " \t\r\n"
+            ):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(
+                "Expected one of '{}' in TubeArchivist list response, found '{}'.".format(  # noqa: E501
+                    chars, char
+                )
+            )
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number cut short by the chunk may go on in the next one.
+                if (
+                    end < len(self.buffer)
+                    and self.buffer[end] not in ".eE"
+                    or self.eof
+                ):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def array(self):
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def items(self):
+        for item in self.parse():
+            yield item
+        # Read to the end of the body, so its connection can be reused.
+        for _ in self.chunks:
+            pass
+
+    def parse(self):
+        if self.expect("[{") == "[":
+            for item in self.array():
+                yield item
+            return
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            if key == "data" and self.peek() == "[":
+                self.pos += 1
+                for item in self.array():
+                    yield item
+            else:
+                self.extra[key] = self.value()
+            if self.expect(",}") == "}":
+                return
+
+
+def iter_ta_list_pages(request_url, fields=None):
+    """Yield the items of each page of a paginated TA list endpoint.
+
+    Pages are decoded while they download, and with `fields` every item is
+    cut down to those fields (see `compact_snapshot_item`) as it is read.
+    """
+    page = 1
+    separator = "&" if "?" in request_url else "?"
+    while True:
+        Log.info("Requesting page {} of '{}'".format(page, request_url))
+        reader = TAJSONListReader(
+            stream_url(
+                ta_api_request(
+                    "{}{}page={}".format(request_url, separator, page)
+                )
+            )
+        )
+        items = [
+            compact_snapshot_item(item, fields) if fields else item
+            for item in reader.items()
+        ]
+        yield items
+        last_page = (reader.extra.get("paginate") or {}).get("last_page")
+        if not items or not last_page or page >= last_page:
+            return
+        page += 1
+
+
+@timed_phase("listing")
+def get_ta_channel_videos(chid):
+    video_lookup = {}
+    if not TA_CONFIG or not chid:
+        return video_lookup
+    request_url = "{}/api/channel/{}/video/".format(TA_CONFIG["ta_url"], chid)
+    pages = 0
+    try:
+        for videos in iter_ta_list_pages(request_url, LISTING_FIELDS):
+            pages += 1
+            if pages == 1:
+                cache_listed_channel(chid, videos)
+            videos = [
+                compact_snapshot_item(video, SNAPSHOT_FIELDS["video"])
+                for video in videos
+            ]
+            cache_listed_videos(videos)
+            for video in videos:
+                try:
+                    metadata = process_ta_video_response(video)
+                except Exception as e:
+                    Log.debug(
+                        "Skipping listed video that could not be processed, Exception: '{}'".format(  # noqa: E501
+                            e
+                        )
+                    )
+                    continue
+                video_lookup[metadata["ytid"]] = metadata
+    except Exception as e:
+        Log.error(
+            "Error requesting video listing from TubeArchivist with URL '{}', Exception: '{}'".format(  # noqa: E501
+                request_url, e
+            )
+        )
+    Log.info(
+        "Prefetched {} videos for YouTube channel {} in {} request(s).".format(
+            len(video_lookup), chid, pages
+        )
+    )
+    return video_lookup
+
+
+def cache_listed_channel(chid, videos):
+    """Cache the channel document embedded in a channel's listed videos.
+
+    The agent reads the shared cache before asking TA, so the first refresh
+    of a scanned channel does not request the channel again. A cached
+    channel response is never replaced by the embedded copy.
+    """
+    if not videos or get_cached_ta_metadata(chid, "channel"):
+        return
+    channel = videos[0].get("channel") or {}
+    if channel.get("channel_id") != chid or any(
+        key not in channel for key in SNAPSHOT_FIELDS["channel"]
+    ):
+        return
+    set_cached_ta_metadata(
+        chid,
+        "channel",
+        {"data": channel} if TA_CONFIG["version"] < [0, 5, 0] else channel,
+    )
+
+
+def cache_listed_videos(videos):
+    cache = get_metadata_cache()
+    if not cache:
+        return
+    wrap = TA_CONFIG["version"] < [0, 5, 0]
+    try:
+        cache.put_many(
+            "video",
+            ta_version_string(),
+            [
+                (video["youtube_id"], {"data": video} if wrap else video)
+                for video in videos
+                if "youtube_id" in video
+            ],
+        )
+    except Exception as e:
+        Log.error(
+            "Unable to cache listed videos, Exception: '{}'".format(e)
+        )
+
+
+def lookup_ta_video_metadata(ytid, video_lookup):
+    if ytid in video_lookup:
+        return video_lookup[ytid]
+    Log.debug(
+        "YouTube video {} was not returned by the channel listing, requesting it directly.".format(  # noqa: E501
+            ytid
+        )
+    )
+    return get_ta_video_metadata(ytid)
+
+
+def get_channel_id_from_folder(folder):
+    match = CHANNEL_ID_REGEX.search(folder)
+    return match.group(0) if match else ""
+
+
 def get_ta_channel_metadata(chid):
     mtype = "channel"
     if not TA_CONFIG:
@@ -559,12 +2006,438 @@ def get_ta_channel_metadata(chid):
         raise e
 
 
+class TAScanManifest(object):
+    """SQLite record of resolved files, so unchanged files skip the API."""
+
+    def __init__(self, path, ttl=DEFAULT_MANIFEST_TTL):
+        self.ttl = ttl
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS manifest ("
+            "library TEXT NOT NULL, folder TEXT NOT NULL, "
+            "path TEXT NOT NULL, size INTEGER, mtime REAL, "
+            "resolved_at INTEGER, show TEXT, season TEXT, episode TEXT, "
+            "title TEXT, released_at TEXT, PRIMARY KEY (library, path))"
+        )
+        self.db.commit()
+
+    def load(self, library, folder, stale=False):
+        """Return the folder's entries, including expired ones if `stale`."""
+        entries = {}
+        for row in self.db.execute(
+            "SELECT path, size, mtime, show, season, episode, title "
+            "FROM manifest WHERE library = ? AND folder = ? "
+            "AND resolved_at > ?",
+            (library, folder, 0 if stale else int(time.time() - self.ttl)),
+        ):
+            entries[row[0]] = dict(
+                zip(
+                    ("size", "mtime", "show", "season", "episode", "title"),
+                    row[1:],
+                )
+            )
+        return entries
+
+    def save(self, library, folder, rows, reused=()):
+        """Replace the folder's entries with `rows` from the latest scan.
+
+        Rows whose path is in `reused` were served from the manifest and
+        keep their resolution time; every other row was resolved now.
+        """
+        previous = dict(
+            self.db.execute(
+                "SELECT path, resolved_at FROM manifest "
+                "WHERE library = ? AND folder = ?",
+                (library, folder),
+            ).fetchall()
+        )
+        now = int(time.time())
+        self.db.execute(
+            "DELETE FROM manifest WHERE library = ? AND folder = ?",
+            (library, folder),
+        )
+        self.db.executemany(
+            "INSERT OR REPLACE INTO manifest VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (library, folder, row[0], row[1], row[2])
+                + (
+                    (row[0] in reused and previous.get(row[0])) or now,
+                )
+                + tuple(row[3:])
+                for row in rows
+            ],
+        )
+        self.db.commit()
+
+
+def get_scan_manifest():
+    global SCAN_MANIFEST
+    if SCAN_MANIFEST is None:
+        SCAN_MANIFEST = False
+        ttl = int(
+            Dict(TA_CONFIG, "ta_manifest_ttl", default=DEFAULT_MANIFEST_TTL)
+        )
+        if sqlite3 is None or ttl <= 0:
+            Log.info("Incremental scanning is disabled.")
+            return SCAN_MANIFEST
+        manifest_file = os.path.join(
+            PLEX_ROOT, AGENT_DATA_LOCATION, "ta_scan_manifest.db"
+        )
+        try:
+            SCAN_MANIFEST = TAScanManifest(manifest_file, ttl)
+        except Exception as e:
+            Log.error(
+                "Unable to open scan manifest '{}', Exception: '{}'".format(
+                    manifest_file, e
+                )
+            )
+    return SCAN_MANIFEST
+
+
+def load_manifest_entries(manifest, library, folder, stale=False):
+    if not manifest:
+        return {}
+    try:
+        return manifest.load(library, folder, stale)
+    except Exception as e:
+        Log.error(
+            "Unable to read scan manifest for '{}', Exception: '{}'".format(
+                folder, e
+            )
+        )
+        return {}
+
+
+def save_manifest_entries(manifest, library, folder, rows, reused=()):
+    if not manifest:
+        return
+    try:
+        manifest.save(library, folder, rows, reused)
+    except Exception as e:
+        Log.error(
+            "Unable to update scan manifest for '{}', Exception: '{}'".format(
+                folder, e
+            )
+        )
+
+
+def get_library_root(path, files):
+    """Return the library location that `path` and `files` are relative to."""
+    if not files:
+        return ""
+    folder = os.path.dirname(files[0])
+    if path and folder.endswith(path):
+        folder = folder[: -len(path)]  # noqa: E203
+    return folder.rstrip(os.sep)
+
+
+def read_library_roots(filename):
+    if not os.path.isfile(filename):
+        return {}
+    try:
+        with open(filename, "rb") as index:
+            return json.loads(index.read().decode("utf-8"))
+    except Exception as e:
+        Log.error(
+            "Unable to read library root index '{}', Exception: '{}'".format(
+                filename, e
+            )
+        )
+        return {}
+
+
+def replace_file(source, target):
+    """Move `source` over `target` without a moment where it is missing."""
+    if hasattr(os, "replace"):
+        os.replace(source, target)  # Python >= 3.3
+        return
+    if os.name == "nt" and os.path.exists(target):
+        os.remove(target)  # os.rename cannot replace files on Windows
+    os.rename(source, target)
+
+
+def write_library_roots(filename, roots):
+    with open(filename, "wb") as index:
+        index.write(
+            json.dumps(roots, indent=2, sort_keys=True).encode("utf-8")
+        )
+
+
+def acquire_file_lock(lock_filename, timeout):
+    """Create `lock_filename` exclusively, waiting up to `timeout` seconds.
+
+    A lock older than `timeout` was left by a process that died while
+    holding it and is taken over. Returns whether the lock is held.
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            os.close(
+                os.open(lock_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            )
+            return True
+        except OSError:
+            pass
+        try:
+            if os.path.getmtime(lock_filename) < time.time() - timeout:
+                os.remove(lock_filename)
+                continue
+        except OSError:
+            continue  # released meanwhile
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.05)
+
+
+def record_library_root(root):
+    """Add `root` to the index the agent reads to find an item's library.
+
+    The index maps each library root to its title, falling back to the
+    root's folder name when the title is unknown. It is only rewritten
+    when a root is new or renamed. Scanner processes take turns through a
+    lock file, and roots written meanwhile are merged in again right
+    before the index is replaced.
+    """
+    global LIBRARY_ROOTS
+    if not root:
+        return
+    filename = os.path.join(PLEX_ROOT, AGENT_DATA_LOCATION, LIBRARY_ROOTS_NAME)
+    if LIBRARY_ROOTS is None:
+        LIBRARY_ROOTS = read_library_roots(filename)
+    title = Dict(PLEX_LIBRARY, root, "title") or os.path.basename(root)
+    if LIBRARY_ROOTS.get(root) == title:
+        return
+    temp_filename = "{}.{}.tmp".format(filename, os.getpid())
+    lock_filename = "{}.lock".format(filename)
+    locked = False
+    replaced = False
+    try:
+        folder = os.path.dirname(filename)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        locked = acquire_file_lock(lock_filename, LIBRARY_ROOTS_LOCK_TIMEOUT)
+        if not locked:
+            Log.warning(
+                "Timed out waiting for '{}', updating the library root index without it.".format(  # noqa: E501
+                    lock_filename
+                )
+            )
+        roots = read_library_roots(filename)
+        roots[root] = title
+        write_library_roots(temp_filename, roots)
+        latest = read_library_roots(filename)
+        if any(key not in roots for key in latest):
+            latest[root] = title
+            write_library_roots(temp_filename, latest)
+        replace_file(temp_filename, filename)
+        replaced = True
+        # Keep what is on disk rather than what was written, so a root
+        # dropped by an unlocked writer is recorded again by the next scan.
+        LIBRARY_ROOTS = read_library_roots(filename)
+        Log.info("Recorded library root '{}' as '{}'.".format(root, title))
+    except Exception as e:
+        Log.error(
+            "Unable to update library root index '{}', Exception: '{}'".format(
+                filename, e
+            )
+        )
+    finally:
+        if not replaced:
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+        if locked:
+            try:
+                os.remove(lock_filename)
+            except OSError:
+                pass
+
+
+def classify_filename(filename):
+    """Match a filename (without extension) against the TA layouts.
+
+    Returns a `FilenameMatch`, or None when the name follows neither layout.
+    """
+    match = TA_FILENAME_REGEX.match(filename)
+    if not match:
+        return None
+    if match.group("ytid"):
+        return FilenameMatch(LAYOUT_CURRENT, match.group("ytid"), None, None)
+    return FilenameMatch(
+        LAYOUT_LEGACY,
+        match.group("legacy_ytid"),
+        match.group("date"),
+        match.group("title"),
+    )
+
+
+def episode_from_metadata(video_metadata):
+    """Map processed video metadata to `(show, season, episode, title)`."""
+    show = video_metadata["show"]
+    if "video" in video_metadata["type"]:
+        title = video_metadata["title"]
+        season = video_metadata["season"]
+    else:
+        title = "[{}] {}".format(
+            video_metadata["type"].upper(),
+            video_metadata["title"],
+        )
+        season = 0
+    episode = video_metadata["episode"]
+    return show, str(season), episode, title
+
+
+def release_date(episode_number):
+    episode_split = [
+        str(episode_number[x : x + 2])  # noqa: E203
+        for x in range(0, len(episode_number), 2)
+    ]
+    return str(
+        "{}-{}-{}".format(
+            episode_split[0],
+            episode_split[1],
+            episode_split[2],
+        )
+    )
+
+
+@timed_phase("resolve")
+def should_prefetch_channel(files, lookup_state):
+    """Whether enough of the scan's files need TA to list the whole channel.
+
+    Only files that missed the scan manifest and the metadata cache count,
+    and they must also outnumber the listing pages the folder's files
+    alone would take. New downloads in a known channel are therefore
+    looked up one by one instead of listing every video of the channel.
+    """
+    if lookup_state["prefetch"] is None:
+        threshold = max(
+            int(
+                Dict(
+                    TA_CONFIG,
+                    "ta_prefetch_min_files",
+                    default=DEFAULT_PREFETCH_MIN_FILES,
+                )
+            ),
+            -(-len(files) // LISTING_PAGE_SIZE),
+        )
+        uncached = 0
+        for path in lookup_state["pending"]:
+            match = classify_filename(
+                os.path.splitext(os.path.basename(path))[0]
+            )
+            if match and not get_cached_ta_metadata(match.ytid, "video"):
+                uncached += 1
+                if uncached >= threshold:
+                    break
+        lookup_state["prefetch"] = uncached >= threshold
+    return lookup_state["prefetch"]
+
+
+def resolve_ta_episode(file, files, lookup_state):
+    """Resolve a filename to `(show, season, episode, title)` through TA."""
+    match = classify_filename(file)
+    video_metadata = {}
+    if not match:
+        return None
+    log_file_info("File matches expected filename layout.")
+    if not (TA_CONFIG["online"] or use_ta_snapshot()):
+        Log.error(
+            "TubeArchivist instance is not accessible or not online. Unable to process video file."  # noqa: E501
+        )
+        return None
+    if TA_CONFIG["version"] == []:
+        Log.error(
+            "TubeArchivist instance version is unknown or unset. Please review the logs further and ensure that there is connectivity between Plex and TubeArchivist."  # noqa: E501
+        )
+        return None
+    if match.layout == LAYOUT_LEGACY:
+        log_file_info("Processing filename with legacy filename format.")
+    ytid = match.ytid
+    try:
+        if (
+            lookup_state["videos"] is None
+            and not use_ta_snapshot()
+            and not deadline_expired()
+            and not get_cached_ta_metadata(ytid, "video")
+            and should_prefetch_channel(files, lookup_state)
+        ):
+            if not lookup_state["channel_id"]:
+                # Legacy folders are named after the channel, so learn the ID from this video.  # noqa: E501
+                lookup_state["channel_id"] = get_ta_video_metadata(ytid)[
+                    "channel_id"
+                ]
+            lookup_state["videos"] = get_ta_channel_videos(
+                lookup_state["channel_id"]
+            )
+        video_metadata = lookup_ta_video_metadata(
+            ytid, lookup_state["videos"] or {}
+        )
+        return episode_from_metadata(video_metadata)
+    except TADeadlineExceeded:
+        raise
+    except Exception as e:
+        Log.error(
+            "Issue with fetching or setting metadata from video using response metadata: '%s', Exception: '%s'"  # noqa: E501
+            % (str(video_metadata), e)
+        )
+        return None
+
+
+def resolve_past_deadline(path, file, files, lookup_state, manifest_state):
+    """Resolve a file the deadline left without cached or snapshot metadata.
+
+    Returns `(resolved, from_manifest)`. A file matched by an earlier scan
+    keeps that match, even if it expired or the file changed since. Any
+    other file is resolved from TA regardless of the deadline, so that no
+    file is dropped from the library.
+    """
+    if manifest_state["stale"] is None:
+        manifest_state["stale"] = load_manifest_entries(
+            manifest_state["manifest"],
+            manifest_state["library"],
+            manifest_state["folder"],
+            stale=True,
+        )
+    entry = manifest_state["stale"].get(path)
+    if entry:
+        Log.warning(
+            "Deadline reached, keeping the previous match of '{}'.".format(
+                file
+            )
+        )
+        return (
+            (entry["show"], entry["season"], entry["episode"], entry["title"]),
+            True,
+        )
+    Log.warning(
+        "Deadline reached, resolving '{}' from TubeArchivist anyway.".format(
+            file
+        )
+    )
+    resolved = without_deadline(resolve_ta_episode, file, files, lookup_state)
+    return resolved, False
+
+
+@instrumented("Scan")
 def Scan(path, files, mediaList, subdirs):  # noqa: C901
     setup()
     load_ta_config()
-    TA_CONFIG["online"] = None
-    TA_CONFIG["version"] = []
-    TA_CONFIG["online"], TA_CONFIG["version"] = test_ta_connection()
+    configure_log_output()
+    start_deadline(
+        float(
+            Dict(TA_CONFIG, "ta_scan_deadline", default=DEFAULT_SCAN_DEADLINE)
+        )
+    )
+    TA_CONFIG["online"], TA_CONFIG["version"] = check_ta_connection()
+    if use_ta_snapshot():
+        Log.info("Resolving files from the local TubeArchivist snapshot.")
+        TA_CONFIG["version"] = get_ta_snapshot()["version"]
     Log.info("Initiating scan of library files...")
     VideoFiles.Scan(path, files, mediaList, subdirs)
 
@@ -573,105 +2446,127 @@ def Scan(path, files, mediaList, subdirs):  # noqa: C901
     if len(paths) > 0 and len(paths[0]) > 0:
         done = False
         episode_counts = {}
+        lookup_state = {
+            "channel_id": get_channel_id_from_folder(paths[0]),
+            "videos": None,
+            "pending": [],
+            "prefetch": None,
+        }
+        library = get_library_root(path, files)
+        record_library_root(library)
+        manifest = get_scan_manifest()
+        manifest_entries = load_manifest_entries(manifest, library, path)
+        manifest_state = {
+            "manifest": manifest,
+            "library": library,
+            "folder": path,
+            "stale": None,
+        }
+        manifest_rows = []
+        reused = set()
+        added = 0
+        unchanged = 0
+        checked = []
+        for i in files:
+            try:
+                file_stat = os.stat(i)
+            except OSError:
+                file_stat = None
+            entry = manifest_entries.get(i)
+            if not (
+                entry
+                and file_stat
+                and entry["size"] == file_stat.st_size
+                and entry["mtime"] == file_stat.st_mtime
+            ):
+                entry = None
+                lookup_state["pending"].append(i)
+            checked.append((i, file_stat, entry))
         if not done:
-            (show, year) = VideoFiles.CleanName(paths[0])
-
-            for i in files:
+            for i, file_stat, entry in checked:
                 file = os.path.basename(i)
-                Log.info("Processing file with scanner: {}".format(file))
+                log_file_info("Processing file with scanner: {}".format(file))
                 (file, ext) = os.path.splitext(file)
-                episode = ""
-
-                for rx in TA_REGEXS:
-                    match = re.search(rx, file, re.IGNORECASE)
-                    video_metadata = {}
-                    if match:
-                        Log.info("File matches expected filename layout.")
-                        if TA_CONFIG["online"]:
-                            if TA_CONFIG["version"] == []:
-                                Log.error(
-                                    "TubeArchivist instance version is unknown or unset. Please review the logs further and ensure that there is connectivity between Plex and TubeArchivist."  # noqa: E501
-                                )
-                                break
-                            if TA_CONFIG["version"] < [0, 3, 7]:
-                                Log.info(
-                                    "Processing filename with legacy filename format."  # noqa: E501
-                                )
-                                originalAirDate = file[0:7]
-                                ytid = file[9:20]
-                                title = file[21:]
-                                season = originalAirDate[0:4]
-                                episode = originalAirDate[5:]
-                            else:
-                                ytid = file
-                            try:
-                                video_metadata = get_ta_video_metadata(ytid)
-                                show = video_metadata["show"]
-                                if "video" in video_metadata["type"]:
-                                    title = video_metadata["title"]
-                                    season = video_metadata["season"]
-                                else:
-                                    title = "[{}] {}".format(
-                                        video_metadata["type"].upper(),
-                                        video_metadata["title"],
-                                    )
-                                    season = 0
-                                episode = video_metadata["episode"]
-                            except Exception as e:
-                                Log.error(
-                                    "Issue with fetching or setting metadata from video using response metadata: '%s', Exception: '%s'"  # noqa: E501
-                                    % (str(video_metadata), e)
-                                )
-                                continue
-                        else:
-                            Log.error(
-                                "TubeArchivist instance is not accessible or not online. Unable to process video file."  # noqa: E501
-                            )
-                            break
-
-                        if show not in episode_counts:
-                            episode_counts[show] = {}
-                        if season not in episode_counts[show]:
-                            episode_counts[show][season] = {}
-                        if episode not in episode_counts[show][season]:
-                            episode_counts[show][season][episode] = 0
-                        episode_counts[show][season][episode] += 1
-                        episode = "{}{:02d}".format(
-                            str(episode[2:]),
-                            episode_counts[show][season][episode],
+                if entry:
+                    log_file_info("File is unchanged since the last scan.")
+                    unchanged += 1
+                    reused.add(i)
+                    resolved = (
+                        entry["show"],
+                        entry["season"],
+                        entry["episode"],
+                        entry["title"],
+                    )
+                else:
+                    try:
+                        resolved = resolve_ta_episode(
+                            file, files, lookup_state
+                        )
+                    except TADeadlineExceeded:
+                        resolved, from_manifest = resolve_past_deadline(
+                            i, file, files, lookup_state, manifest_state
                         )
+                        if from_manifest:
+                            reused.add(i)
+                if not resolved:
+                    continue
+                (show, season, episode, title) = resolved
 
-                        tv_show = Media.Episode(
-                            str(show).encode("UTF-8"),
-                            str(season).encode("UTF-8"),
+                if show not in episode_counts:
+                    episode_counts[show] = {}
+                if season not in episode_counts[show]:
+                    episode_counts[show][season] = {}
+                if episode not in episode_counts[show][season]:
+                    episode_counts[show][season][episode] = 0
+                episode_counts[show][season][episode] += 1
+                episode_number = "{}{:02d}".format(
+                    str(episode[2:]),
+                    episode_counts[show][season][episode],
+                )
+
+                tv_show = Media.Episode(
+                    str(show).encode("UTF-8"),
+                    str(season).encode("UTF-8"),
+                    episode_number,
+                    str(title).encode("UTF-8"),
+                    str(season).encode("UTF-8"),
+                )
+                log_file_info(
+                    "Identified episode '{} - {}' with TV Show {} under Season {}.".format(  # noqa: E501
+                        episode_number, title, show, season
+                    )
+                )
+                released_at = release_date(episode_number)
+                tv_show.released_at = released_at.encode("UTF-8")
+                tv_show.parts.append(i)
+                log_file_info(
+                    "Adding episode '{}' to TV show '{}' list of episodes.".format(  # noqa: E501
+                        episode_number, show
+                    )
+                )
+                mediaList.append(tv_show)
+                added += 1
+                if file_stat:
+                    manifest_rows.append(
+                        (
+                            i,
+                            file_stat.st_size,
+                            file_stat.st_mtime,
+                            show,
+                            season,
                             episode,
-                            str(title).encode("UTF-8"),
-                            str(season).encode("UTF-8"),
-                        )
-                        Log.info(
-                            "Identified episode '{} - {}' with TV Show {} under Season {}.".format(  # noqa: E501
-                                episode, title, show, season
-                            )
+                            title,
+                            released_at,
                         )
-                        episode_split = [
-                            str(episode[x : x + 2])  # noqa: E203
-                            for x in range(0, len(episode), 2)
-                        ]
-                        tv_show.released_at = str(
-                            "{}-{}-{}".format(
-                                episode_split[0],
-                                episode_split[1],
-                                episode_split[2],
-                            )
-                        ).encode("UTF-8")
-                        tv_show.parts.append(i)
-                        Log.info(
-                            "Adding episode '{}' to TV show '{}' list of episodes.".format(  # noqa: E501
-                                episode, show
-                            )
-                        )
-                        mediaList.append(tv_show)
-                        break
+                    )
+        save_manifest_entries(
+            manifest, library, path, manifest_rows, reused
+        )
+        Log.info(
+            "Scanned {} files in '{}': {} episodes added ({} unchanged since the last scan), {} skipped.".format(  # noqa: E501
+                len(files), path, added, unchanged, len(files) - added
+            )
+        )
 
     Stack.Scan(path, files, mediaList, subdirs)
     Log.info("Scan completed for library files.")
@@ -679,6 +2574,19 @@ def Scan(path, files, mediaList, subdirs):  # noqa: C901
 
 if __name__ == "__main__":
     print("{} for Plex!".format(SOURCE))
+    if sys.argv[1] == "--export-snapshot":
+        setup()
+        load_ta_config()
+        TA_CONFIG["online"], TA_CONFIG["version"] = check_ta_connection()
+        if not TA_CONFIG["online"]:
+            sys.exit("TubeArchivist is not accessible, no snapshot exported.")
+        print(
+            "Snapshot exported: ",
+            export_ta_snapshot(
+                sys.argv[2] if len(sys.argv) > 2 else get_snapshot_path()
+            ),
+        )
+        sys.exit(0)
     path = sys.argv[1]
     files = [os.path.join(path, file) for file in os.listdir(path)]
     media = []
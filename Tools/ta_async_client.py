@@ -0,0 +1,177 @@
+"""Asynchronous TubeArchivist API client for the standalone tools.
+
+Requires Python 3.7 or newer and only uses the standard library: requests
+are sent over a small pool of keep-alive HTTP/1.1 connections opened with
+`asyncio.open_connection`, limited by a semaphore.
+"""
+
+import asyncio
+import json
+import ssl
+from urllib.parse import urlsplit
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 30
+
+
+def make_ssl_context(verify=False):
+    """Return the TLS context for HTTPS connections.
+
+    Like the Scanner, certificates are not verified unless `verify` is set,
+    so self-signed TubeArchivist instances that work in Plex work here too.
+    """
+    if verify:
+        return ssl.create_default_context()
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class TAClientError(Exception):
+    """TubeArchivist answered with an unexpected HTTP status."""
+
+    def __init__(self, path, status):
+        super().__init__("HTTP {} for {}".format(status, path))
+        self.path = path
+        self.status = status
+
+
+class TAAsyncClient:
+    """Concurrent GET requests against one TubeArchivist instance."""
+
+    def __init__(
+        self,
+        ta_url,
+        api_key,
+        concurrency=DEFAULT_CONCURRENCY,
+        timeout=DEFAULT_TIMEOUT,
+        verify=False,
+    ):
+        url = urlsplit(ta_url)
+        self.https = url.scheme == "https"
+        self.host = url.hostname
+        self.port = url.port or (443 if self.https else 80)
+        self.netloc = url.netloc
+        self.prefix = url.path.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.idle = []
+        self.ssl_context = make_ssl_context(verify) if self.https else None
+        self.requests = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        while self.idle:
+            _, writer = self.idle.pop()
+            writer.close()
+
+    async def get(self, path):
+        """Return `(status, body)` for `path`, relative to the TA URL."""
+        async with self.semaphore:
+            conn = self.idle.pop() if self.idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = await self._connect()
+            try:
+                status, keep_alive, body = await asyncio.wait_for(
+                    self._exchange(conn, path), self.timeout
+                )
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                conn[1].close()
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection, retry once.
+                conn = await self._connect()
+                status, keep_alive, body = await asyncio.wait_for(
+                    self._exchange(conn, path), self.timeout
+                )
+            except BaseException:
+                conn[1].close()
+                raise
+            if keep_alive:
+                self.idle.append(conn)
+            else:
+                conn[1].close()
+            return status, body
+
+    async def get_json(self, path):
+        """Return the decoded JSON body of `path`, or None for HTTP 404."""
+        status, body = await self.get(path)
+        if status == 404:
+            return None
+        if status >= 300:
+            raise TAClientError(path, status)
+        return json.loads(body.decode("utf-8"))
+
+    async def get_videos(self, ytids):
+        """Request `/api/video/<id>/` for every ID at once.
+
+        Returns `{ytid: response or exception}`; IDs unknown to TA map to None.
+        """
+        results = await asyncio.gather(
+            *[self.get_json("/api/video/{}/".format(ytid)) for ytid in ytids],
+            return_exceptions=True,
+        )
+        return dict(zip(ytids, results))
+
+    async def _connect(self):
+        return await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=self.ssl_context,
+                server_hostname=self.host if self.https else None,
+            ),
+            self.timeout,
+        )
+
+    async def _exchange(self, conn, path):
+        reader, writer = conn
+        self.requests += 1
+        writer.write(
+            (
+                "GET {}{} HTTP/1.1\r\n"
+                "Host: {}\r\n"
+                "Authorization: Token {}\r\n"
+                "Accept: application/json\r\n"
+                "Connection: keep-alive\r\n\r\n"
+            )
+            .format(self.prefix, path, self.netloc, self.api_key)
+            .encode("latin-1")
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by TubeArchivist")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+            body = bytes(body)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return status, keep_alive, body
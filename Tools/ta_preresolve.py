@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Pre-resolve a TubeArchivist library into the Scanner's scan manifest.
+
+Walks a Plex library folder, resolves every TubeArchivist filename against
+`/api/video/<id>/` concurrently and records the resulting episodes in the
+scan manifest. Plex scans of unchanged files then read the manifest instead
+of waiting on TubeArchivist.
+
+    python3 Tools/ta_preresolve.py "<Plex Media Server folder>" \
+        "<library folder>"
+
+The Scanner must be installed in the Plex Media Server folder, since its
+`ta_config.json`, metadata cache and manifest are used. Requires Python 3.7+.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+import types
+
+from ta_async_client import DEFAULT_CONCURRENCY, TAAsyncClient
+
+SCANNER_FILE = os.path.join(
+    "Scanners", "Series", "TubeArchivist Series Scanner.py"
+)
+VIDEO_EXTENSIONS = {".mp4", ".mkv", ".webm", ".m4v", ".mov", ".avi"}
+
+
+def load_scanner(plex_root):
+    """Import the installed Scanner by path.
+
+    The Plex scanner modules are only used by `Scan()` itself, so empty
+    placeholders are registered when they cannot be imported here.
+    """
+    for name in ("Media", "Stack", "Utils", "VideoFiles"):
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            sys.modules[name] = types.ModuleType(name)
+    filename = os.path.join(plex_root, SCANNER_FILE)
+    spec = importlib.util.spec_from_file_location(
+        "ta_series_scanner", filename
+    )
+    scanner = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(scanner)
+    return scanner
+
+
+def library_folders(library):
+    """Yield `(folder, [files])` the way Plex passes them to `Scan()`."""
+    for root, dirs, names in os.walk(library):
+        dirs.sort()
+        files = [
+            os.path.join(root, name)
+            for name in sorted(names)
+            if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS
+        ]
+        if files:
+            folder = os.path.relpath(root, library)
+            yield ("" if folder == "." else folder), files
+
+
+async def fetch_videos(scanner, ytids, concurrency, verify):
+    config = scanner.TA_CONFIG
+    async with TAAsyncClient(
+        config["ta_url"], config["ta_api_key"], concurrency, verify=verify
+    ) as client:
+        return await client.get_videos(ytids), client.requests
+
+
+def resolve_metadata(scanner, ytid, fetched):
+    """Return processed video metadata, preferring the concurrent fetch."""
+    if ytid not in fetched:
+        return scanner.get_ta_video_metadata(ytid)
+    response = fetched[ytid]
+    if response is None or isinstance(response, Exception):
+        return None
+    if scanner.TA_CONFIG["version"] < [0, 5, 0]:
+        response = response["data"]
+    return scanner.process_ta_video_response(response)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("plex_root", help="Plex Media Server data folder")
+    parser.add_argument("library", help="library folder to pre-resolve")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="simultaneous TubeArchivist requests",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="verify the TubeArchivist HTTPS certificate, which the Scanner"
+        " does not",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    started = time.time()
+    library = os.path.abspath(args.library).rstrip(os.sep)
+    scanner = load_scanner(os.path.abspath(args.plex_root))
+    scanner.setup()
+    scanner.load_ta_config()
+    config = scanner.TA_CONFIG
+    config["online"], config["version"] = scanner.check_ta_connection()
+    if scanner.use_ta_snapshot():
+        config["version"] = scanner.get_ta_snapshot()["version"]
+    elif not config["online"]:
+        sys.exit("TubeArchivist is not accessible, nothing was resolved.")
+    manifest = scanner.get_scan_manifest()
+    if not manifest:
+        sys.exit("The scan manifest is disabled, nothing was resolved.")
+
+    folders = list(library_folders(library))
+    matches = {}
+    for _, files in folders:
+        for path in files:
+            match = scanner.classify_filename(
+                os.path.splitext(os.path.basename(path))[0]
+            )
+            if match:
+                matches[path] = match.ytid
+    ytids = sorted(set(matches.values()))
+    missing = ytids
+    if not scanner.use_ta_snapshot():
+        missing = [
+            ytid
+            for ytid in ytids
+            if not scanner.get_cached_ta_metadata(ytid, "video")
+        ]
+    fetched, requests = {}, 0
+    if missing:
+        fetched, requests = asyncio.run(
+            fetch_videos(scanner, missing, args.concurrency, args.verify)
+        )
+        cache = scanner.get_metadata_cache()
+        if cache:
+            cache.put_many(
+                "video",
+                scanner.ta_version_string(),
+                [
+                    (ytid, response)
+                    for ytid, response in fetched.items()
+                    if response and not isinstance(response, Exception)
+                ],
+            )
+
+    resolved_files = 0
+    for folder, files in folders:
+        rows = []
+        for path in files:
+            if path not in matches:
+                continue
+            try:
+                metadata = resolve_metadata(scanner, matches[path], fetched)
+            except Exception as e:
+                print("Unable to resolve '{}': {}".format(path, e))
+                continue
+            if not metadata:
+                print("Not found in TubeArchivist: '{}'".format(path))
+                continue
+            show, season, episode, title = scanner.episode_from_metadata(
+                metadata
+            )
+            file_stat = os.stat(path)
+            rows.append(
+                (
+                    path,
+                    file_stat.st_size,
+                    file_stat.st_mtime,
+                    show,
+                    season,
+                    episode,
+                    title,
+                    scanner.release_date(episode[2:]),
+                )
+            )
+        scanner.save_manifest_entries(
+            manifest, scanner.get_library_root(folder, files), folder, rows
+        )
+        resolved_files += len(rows)
+    print(
+        "Resolved {} of {} files in {} folders with {} requests in {:.1f}s.".format(  # noqa: E501
+            resolved_files,
+            sum(len(files) for _, files in folders),
+            len(folders),
+            requests,
+            time.time() - started,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""Benchmark the Agent's Search() and Update() against a fake TubeArchivist.
+
+Builds a channel with N seasons x M episodes and drives the Agent with fake
+Plex framework globals: a cold refresh, a refresh after Plex has dropped the
+proxied images, and a refresh of unchanged metadata.
+
+    python benchmarks/bench_agent.py --seasons 5 --episodes 40 --latency 5
+"""
+
+from __future__ import print_function
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import plex_framework
+from fake_ta import FakeTubeArchivist
+from harness import load_agent, peak_rss_mb
+from library import channel_id, video_id
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seasons", type=int, default=3)
+    parser.add_argument("--episodes", type=int, default=50, help="per season")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="milliseconds per request"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests answered with an HTTP error",
+    )
+    parser.add_argument(
+        "--error-status",
+        type=int,
+        default=500,
+        help="status of the injected errors, e.g. 503 to trigger throttling",
+    )
+    parser.add_argument(
+        "--capacity",
+        type=int,
+        default=0,
+        help="requests per second the fake TA serves before answering 503",
+    )
+    parser.add_argument("--ta-version", default="v0.5.1")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="tubearchivist_workers pref"
+    )
+    parser.add_argument(
+        "--cache-ttl", type=int, default=86400, help="tubearchivist_cache_ttl"
+    )
+    parser.add_argument(
+        "--artwork-cache-mb",
+        type=int,
+        default=256,
+        help="tubearchivist_artwork_cache_mb",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="print the Agent's log"
+    )
+    return parser.parse_args()
+
+
+def build_channel(ta, seasons, episodes):
+    chid = channel_id(0)
+    name = "Channel 0000"
+    ta.add_channel(chid, name)
+    by_season = {}
+    for season in range(seasons):
+        year = 2010 + season
+        by_season[str(year)] = []
+        for index in range(episodes):
+            ytid = video_id(season, index)
+            ta.add_video(
+                ytid,
+                chid,
+                "{:04d}-{:02d}-{:02d}".format(
+                    year, 1 + index // 28 % 12, 1 + index % 28
+                ),
+                "Video {}".format(index),
+            )
+            by_season[str(year)].append("{}.mp4".format(ytid))
+    show = "{} [{}]".format(name, chid)
+    return show, plex_framework.build_media(
+        show, "/library/{}".format(chid), by_season
+    )
+
+
+def timed(ta, func):
+    ta.reset_counts()
+    start = time.time()
+    error = None
+    try:
+        func()
+    except Exception as e:
+        error = e
+    return time.time() - start, error
+
+
+def report(label, ta, elapsed, episodes, error):
+    print(
+        "{:<16} {:>8.3f}s {:>8.2f} ms/episode {:>6.2f} req/episode"
+        " {:>9.1f} KB/episode  {}{}".format(
+            label,
+            elapsed,
+            elapsed * 1000 / episodes,
+            ta.total_requests() / float(episodes),
+            ta.total_bytes() / 1024.0 / episodes,
+            ", ".join(
+                "{}={}".format(kind, count)
+                for kind, count in sorted(ta.counts.items())
+            )
+            or "no requests",
+            "  raised {!r}".format(error) if error else "",
+        )
+    )
+
+
+def main():
+    args = parse_args()
+    ta = FakeTubeArchivist(
+        version=args.ta_version,
+        latency=args.latency / 1000.0,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        capacity=args.capacity,
+    ).start()
+    data_path = tempfile.mkdtemp(prefix="ta-agent-")
+    try:
+        show, media = build_channel(ta, args.seasons, args.episodes)
+        episodes = args.seasons * args.episodes
+        agent = load_agent(
+            data_path,
+            {
+                "tubearchivist_url": ta.url,
+                "tubearchivist_workers": str(args.workers),
+                "tubearchivist_cache_ttl": str(args.cache_ttl),
+                "tubearchivist_artwork_cache_mb": str(args.artwork_cache_mb),
+            },
+            args.verbose,
+        )
+        print(
+            "Refreshing {} seasons x {} episodes, {}ms latency, {:.0%} errors,"
+            " {} workers".format(
+                args.seasons,
+                args.episodes,
+                args.latency,
+                args.error_rate,
+                args.workers,
+            )
+        )
+
+        results = plex_framework.SearchResults()
+        elapsed, error = timed(
+            ta,
+            lambda: (
+                agent.load_ta_config(),
+                agent.Search(results, media, "en", False),
+            ),
+        )
+        report("search (1 call)", ta, elapsed, 1, error)
+        if not results:
+            return
+        guid = results[0]["id"]
+
+        metadata = plex_framework.MetadataShow(guid)
+        elapsed, error = timed(
+            ta,
+            lambda: (
+                agent.load_ta_config(),
+                agent.Update(metadata, media, "en", False),
+            ),
+        )
+        report("update cold", ta, elapsed, episodes, error)
+
+        elapsed, error = timed(
+            ta,
+            lambda: (
+                agent.load_ta_config(),
+                agent.Update(
+                    plex_framework.MetadataShow(guid), media, "en", False
+                ),
+            ),
+        )
+        report("update reload", ta, elapsed, episodes, error)
+
+        elapsed, error = timed(
+            ta,
+            lambda: (
+                agent.load_ta_config(),
+                agent.Update(metadata, media, "en", False),
+            ),
+        )
+        report("update warm", ta, elapsed, episodes, error)
+        rss = peak_rss_mb()
+        print("peak rss: {}".format("{:.1f} MB".format(rss) if rss else "n/a"))
+        if agent.CONNECTION_POOL:
+            agent.CONNECTION_POOL.close()
+    finally:
+        ta.stop()
+        shutil.rmtree(data_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
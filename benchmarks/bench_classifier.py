@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Micro-benchmark for the scanner's filename classifier.
+
+Compares the original per-pattern `re.search` loop with the precompiled
+single-pass `classify_filename` over synthetic TubeArchivist filenames.
+
+    python benchmarks/bench_classifier.py [count]
+"""
+
+from __future__ import print_function
+
+import random
+import re
+import string
+import sys
+import time
+
+from harness import load_scanner
+
+LEGACY_REGEXS = [
+    "[0-9]{8}_[a-zA-Z0-9_-]{11}_*.*",
+    "[a-zA-Z0-9_-]{11}.*",
+]
+YTID_CHARS = string.ascii_letters + string.digits + "_-"
+
+
+def synthetic_filenames(count, seed=0):
+    rng = random.Random(seed)
+    names = []
+    for index in range(count):
+        ytid = "".join(rng.choice(YTID_CHARS) for _ in range(11))
+        if index % 2:
+            names.append(ytid)
+        else:
+            names.append(
+                "{}{:02d}{:02d}_{}_{}".format(
+                    rng.randint(2006, 2024),
+                    rng.randint(1, 12),
+                    rng.randint(1, 28),
+                    ytid,
+                    "Some Video Title {}".format(index),
+                )
+            )
+    return names
+
+
+def regex_loop(names):
+    matched = 0
+    for name in names:
+        for rx in LEGACY_REGEXS:
+            if re.search(rx, name, re.IGNORECASE):
+                matched += 1
+                break
+    return matched
+
+
+def classifier(names, classify_filename):
+    matched = 0
+    for name in names:
+        if classify_filename(name):
+            matched += 1
+    return matched
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    scanner = load_scanner()
+    names = synthetic_filenames(count)
+    print("Classifying {} synthetic filenames".format(count))
+    for label, run in (
+        ("re.search loop", lambda: regex_loop(names)),
+        (
+            "classify_filename",
+            lambda: classifier(names, scanner.classify_filename),
+        ),
+    ):
+        start = time.time()
+        matched = run()
+        elapsed = time.time() - start
+        print(
+            "{:<20} {:>8.3f}s {:>12.0f} names/s  matched={}".format(
+                label, elapsed, count / elapsed, matched
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""Benchmark the Series Scanner against a local fake TubeArchivist.
+
+Builds a synthetic library, then runs `Scan()` once per channel folder the
+way Plex does, first against an empty cache and then again as a rescan.
+
+    python benchmarks/bench_scan.py --channels 20 --files 200 --latency 5
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from fake_ta import FakeTubeArchivist
+from harness import (
+    load_scanner,
+    make_plex_root,
+    peak_rss_mb,
+    remove_plex_root,
+    tracemalloc,
+)
+from library import LAYOUTS, build_library
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--files", type=int, default=100, help="per channel")
+    parser.add_argument(
+        "--layout", choices=LAYOUTS + ("both",), default="both"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="milliseconds per request"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests answered with an HTTP error",
+    )
+    parser.add_argument(
+        "--error-status",
+        type=int,
+        default=500,
+        help="status of the injected errors, e.g. 503 to trigger throttling",
+    )
+    parser.add_argument(
+        "--capacity",
+        type=int,
+        default=0,
+        help="requests per second the fake TA serves before answering 503",
+    )
+    parser.add_argument("--ta-version", default="v0.5.1")
+    parser.add_argument(
+        "--page-size", type=int, default=12, help="items per listing page"
+    )
+    parser.add_argument(
+        "--extra-bytes",
+        type=int,
+        default=0,
+        help="approximate size of unused fields added to each video",
+    )
+    parser.add_argument(
+        "--rescans", type=int, default=1, help="warm scans after the first"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="report tracemalloc peaks (Python 3, slows the scan)",
+    )
+    parser.add_argument(
+        "--expire-manifest",
+        action="store_true",
+        help="age the scan manifest past its TTL, rescan and fail unless the"
+        " re-resolved files are served from the manifest again",
+    )
+    return parser.parse_args()
+
+
+def run_scan(scanner, folders, trace_memory):
+    media = []
+    if trace_memory and tracemalloc:
+        tracemalloc.start()
+    start = time.time()
+    for folder, files in folders:
+        scanner.Scan(folder, files, media, [])
+    elapsed = time.time() - start
+    traced = None
+    if trace_memory and tracemalloc:
+        traced = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024)
+        tracemalloc.stop()
+    return elapsed, len(media), traced
+
+
+def report(label, files, elapsed, matched, requests, traced):
+    print(
+        "{:<16} {:>7} files {:>8.2f}s {:>9.1f} files/s {:>6.2f} req/file"
+        " {:>7} matched {:>8} rss MB{}".format(
+            label,
+            files,
+            elapsed,
+            files / elapsed if elapsed else 0.0,
+            requests / float(files) if files else 0.0,
+            matched,
+            "{:.1f}".format(peak_rss_mb()) if peak_rss_mb() else "n/a",
+            " {:>7.1f} traced MB".format(traced) if traced is not None else "",
+        )
+    )
+
+
+def manifest_hits(scanner, folders):
+    """Number of files the scan manifest would serve on the next scan."""
+    manifest = scanner.get_scan_manifest()
+    return sum(
+        len(
+            scanner.load_manifest_entries(
+                manifest, scanner.get_library_root(folder, files), folder
+            )
+        )
+        for folder, files in folders
+    )
+
+
+def check_manifest_expiry(scanner, folders):
+    manifest = scanner.get_scan_manifest()
+    if not manifest:
+        print("{:<16} scan manifest is disabled".format("manifest expiry"))
+        return False
+    manifest.db.execute(
+        "UPDATE manifest SET resolved_at = resolved_at - ?",
+        (manifest.ttl + 1,),
+    )
+    manifest.db.commit()
+    expired = manifest_hits(scanner, folders)
+    _, matched, _ = run_scan(scanner, folders, False)
+    refreshed = manifest_hits(scanner, folders)
+    print(
+        "{:<16} {} entries live after expiry,"
+        " {} of {} after re-resolving".format(
+            "manifest expiry", expired, refreshed, matched
+        )
+    )
+    return expired == 0 and refreshed == matched
+
+
+def bench_layout(args, layout):
+    """Run the benchmark for one layout; False if the manifest check failed."""
+    ta = FakeTubeArchivist(
+        version=args.ta_version,
+        latency=args.latency / 1000.0,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        capacity=args.capacity,
+        page_size=args.page_size,
+        extra_bytes=args.extra_bytes,
+    ).start()
+    library_root = tempfile.mkdtemp(prefix="ta-library-")
+    plex_root, scanner_file = make_plex_root(ta.url)
+    try:
+        folders = build_library(
+            ta, library_root, args.channels, args.files, layout
+        )
+        files = args.channels * args.files
+        scanner = load_scanner(scanner_file)
+        for run in range(1 + args.rescans):
+            ta.reset_counts()
+            elapsed, matched, traced = run_scan(
+                scanner, folders, args.trace_memory
+            )
+            report(
+                "{} {}".format(layout, "rescan" if run else "cold"),
+                files,
+                elapsed,
+                matched,
+                ta.total_requests(),
+                traced,
+            )
+            print(
+                "{:<16} requests: {}".format(
+                    "",
+                    ", ".join(
+                        "{}={}".format(kind, count)
+                        for kind, count in sorted(ta.counts.items())
+                    )
+                    or "none",
+                )
+            )
+        passed = True
+        if args.expire_manifest:
+            passed = check_manifest_expiry(scanner, folders)
+        if scanner.CONNECTION_POOL:
+            scanner.CONNECTION_POOL.close()
+        return passed
+    finally:
+        ta.stop()
+        remove_plex_root(plex_root)
+        shutil.rmtree(library_root, ignore_errors=True)
+
+
+def main():
+    args = parse_args()
+    print(
+        "Scanning {} channels x {} files, {}ms latency, {:.0%} errors".format(
+            args.channels, args.files, args.latency, args.error_rate
+        )
+    )
+    failed = [
+        layout
+        for layout in (LAYOUTS if args.layout == "both" else (args.layout,))
+        if not bench_layout(args, layout)
+    ]
+    if failed:
+        sys.exit(
+            "Expired scan manifest entries were not refreshed: {}".format(
+                ", ".join(failed)
+            )
+        )
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+    main()
@@ -0,0 +1,256 @@
+"""A local stand-in for the TubeArchivist API used by the benchmarks.
+
+Serves `/api/ping/`, `/api/video/<id>/`, `/api/channel/<id>/`, the paginated
+`/api/video/`, `/api/channel/` and `/api/channel/<id>/video/` listings and
+`/cache/...` images, with configurable latency, error injection and a
+request-rate capacity above which it answers 503 like a saturated uwsgi.
+"""
+
+import collections
+import datetime
+import json
+import random
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer  # Python >= 3.0
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    from BaseHTTPServer import (  # Python == 2.x
+        BaseHTTPRequestHandler,
+        HTTPServer,
+    )
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlsplit
+
+DEFAULT_PAGE_SIZE = 12
+IMAGE = b"\x89PNG\r\n\x1a\n" + b"\x00" * 4096
+
+
+def endpoint_kind(parts):
+    if parts[:1] == ["cache"]:
+        return "image"
+    if parts[1:2] == ["ping"]:
+        return "ping"
+    if len(parts) == 2 or parts[-1] == "video" and len(parts) == 4:
+        return "list"
+    return parts[1] if len(parts) > 1 else "other"
+
+
+class FakeTubeArchivist(object):
+    """Threaded HTTP server holding an in-memory TubeArchivist library."""
+
+    def __init__(
+        self,
+        version="v0.5.1",
+        latency=0.0,
+        error_rate=0.0,
+        error_status=500,
+        capacity=0,
+        page_size=DEFAULT_PAGE_SIZE,
+        extra_bytes=0,
+        seed=0,
+    ):
+        self.version = version
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.capacity = capacity
+        self.recent = collections.deque()
+        self.page_size = page_size
+        self.extra_bytes = extra_bytes
+        self.random = random.Random(seed)
+        self.channels = {}
+        self.videos = {}
+        self.channel_videos = {}
+        self.counts = {}
+        self.sent = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    @property
+    def version_list(self):
+        return [int(x) for x in self.version.lstrip("v").split(".")]
+
+    @property
+    def legacy_api(self):
+        return self.version_list < [0, 5, 0]
+
+    def format_date(self, date):
+        # TA releases before v0.3.7 sent dates as "01 Jan, 2024".
+        if self.version_list < [0, 3, 7]:
+            return datetime.datetime.strptime(date, "%Y-%m-%d").strftime(
+                "%d %b, %Y"
+            )
+        return date
+
+    def add_channel(self, channel_id, name):
+        self.channels[channel_id] = {
+            "channel_id": channel_id,
+            "channel_name": name,
+            "channel_description": "Synthetic channel {}".format(name),
+            "channel_last_refresh": self.format_date("2024-01-01"),
+            "channel_thumb_url": "/cache/channels/{}_thumb.jpg".format(
+                channel_id
+            ),
+            "channel_tvart_url": "/cache/channels/{}_tvart.jpg".format(
+                channel_id
+            ),
+            "channel_banner_url": "/cache/channels/{}_banner.jpg".format(
+                channel_id
+            ),
+        }
+        self.channel_videos[channel_id] = []
+
+    def add_video(self, youtube_id, channel_id, published, title):
+        channel = self.channels[channel_id]
+        self.videos[youtube_id] = {
+            "youtube_id": youtube_id,
+            "title": title,
+            "published": self.format_date(published),
+            "vid_last_refresh": self.format_date("2024-01-01"),
+            "description": "Synthetic video {}".format(title),
+            "vid_thumb_url": "/cache/videos/{}.jpg".format(youtube_id),
+            "vid_type": "videos",
+            "player": {"duration": 60, "duration_str": "1:00"},
+            # TA embeds a copy of the channel document in every video.
+            "channel": dict(channel),
+        }
+        if self.extra_bytes:
+            # Stand-ins for the fields TA sends but the plugin never reads.
+            self.videos[youtube_id]["tags"] = [
+                "tag{:04d}".format(index)
+                for index in range(self.extra_bytes // 10)
+            ]
+        self.channel_videos[channel_id].append(youtube_id)
+
+    def reset_counts(self):
+        with self.lock:
+            self.counts = {}
+            self.sent = {}
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(self.sent.values())
+
+    def start(self):
+        self.server = ThreadedHTTPServer(("127.0.0.1", 0), FakeTAHandler)
+        self.server.ta = self
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def wrap(self, item):
+        return {"data": item} if self.legacy_api else item
+
+    def page(self, items, query):
+        page = int(query.get("page", ["1"])[0])
+        last_page = max(1, (len(items) + self.page_size - 1) // self.page_size)
+        start = (page - 1) * self.page_size
+        return {
+            "data": items[start : start + self.page_size],  # noqa: E203
+            "paginate": {"current_page": page, "last_page": last_page},
+        }
+
+    def saturated(self):
+        """Count a request against `capacity` per second, True when over."""
+        if not self.capacity:
+            return False
+        now = time.time()
+        while self.recent and now - self.recent[0] >= 1:
+            self.recent.popleft()
+        if len(self.recent) >= self.capacity:
+            return True
+        self.recent.append(now)
+        return False
+
+    def respond(self, path, query):
+        """Return `(status, body)` for a request path."""
+        parts = [part for part in path.split("/") if part]
+        kind = endpoint_kind(parts)
+        with self.lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            failed = self.random.random() < self.error_rate
+            overloaded = self.saturated()
+        if self.latency:
+            time.sleep(self.latency)
+        if overloaded:
+            status, body = 503, b'{"error": "over capacity"}'
+        elif failed:
+            status, body = self.error_status, b'{"error": "injected failure"}'
+        else:
+            status, body = self.route(kind, parts, query)
+        with self.lock:
+            self.sent[kind] = self.sent.get(kind, 0) + len(body)
+        return status, body
+
+    def route(self, kind, parts, query):
+        if kind == "image":
+            return 200, IMAGE
+        body = None
+        if kind == "ping":
+            body = {"response": "pong", "version": self.version}
+        elif parts == ["api", "video"]:
+            body = self.page(
+                [self.videos[ytid] for ytid in sorted(self.videos)], query
+            )
+        elif parts == ["api", "channel"]:
+            body = self.page(
+                [self.channels[chid] for chid in sorted(self.channels)], query
+            )
+        elif len(parts) == 4 and parts[1] == "channel":
+            if parts[2] in self.channel_videos:
+                body = self.page(
+                    [
+                        self.videos[ytid]
+                        for ytid in self.channel_videos[parts[2]]
+                    ],
+                    query,
+                )
+        elif len(parts) == 3 and parts[1] == "video":
+            if parts[2] in self.videos:
+                body = self.wrap(self.videos[parts[2]])
+        elif len(parts) == 3 and parts[1] == "channel":
+            if parts[2] in self.channels:
+                body = self.wrap(self.channels[parts[2]])
+        if body is None:
+            return 404, b'{"error": "not found"}'
+        return 200, json.dumps(body).encode("utf-8")
+
+
+class FakeTAHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Avoid delayed-ACK stalls on keep-alive
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        status, body = self.server.ta.respond(url.path, parse_qs(url.query))
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
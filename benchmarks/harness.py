@@ -0,0 +1,88 @@
+"""Helpers for loading the scanner and agent outside of Plex."""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.dirname(BENCHMARK_PATH)
+SCANNER_FILE = os.path.join(
+    REPO_PATH, "Scanners", "Series", "TubeArchivist Series Scanner.py"
+)
+AGENT_FILE = os.path.join(REPO_PATH, "Contents", "Code", "__init__.py")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import tracemalloc
+except ImportError:  # Python == 2.x
+    tracemalloc = None
+
+
+def load_source(name, filename):
+    try:
+        import importlib.util
+    except ImportError:  # Python == 2.x
+        import imp
+
+        return imp.load_source(name, filename)
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_scanner(filename=SCANNER_FILE):
+    """Import the scanner with the Plex scanner modules stubbed out."""
+    stubs = os.path.join(BENCHMARK_PATH, "plex_stubs")
+    if stubs not in sys.path:
+        sys.path.insert(0, stubs)
+    return load_source("ta_series_scanner", filename)
+
+
+def load_agent(data_path, prefs=None, verbose=False, filename=AGENT_FILE):
+    """Import the agent with fake Plex framework globals.
+
+    `data_path` replaces the agent's data directory, which holds the
+    metadata and artwork caches.
+    """
+    import plex_framework
+
+    plex_framework.install(prefs, verbose)
+    agent = load_source("tubearchivist_agent", filename)
+    agent.CachePath = data_path
+    return agent
+
+
+def make_plex_root(ta_url, **config):
+    """Create a throwaway Plex data directory with the scanner installed.
+
+    The scanner locates `ta_config.json`, its logs and the shared cache
+    relative to its own file, so every benchmark run gets a fresh copy.
+    """
+    plex_root = tempfile.mkdtemp(prefix="ta-bench-")
+    scanners = os.path.join(plex_root, "Scanners", "Series")
+    os.makedirs(scanners)
+    scanner_file = os.path.join(scanners, os.path.basename(SCANNER_FILE))
+    shutil.copy(SCANNER_FILE, scanner_file)
+    config.update({"ta_url": ta_url, "ta_api_key": "benchmark"})
+    with open(os.path.join(scanners, "ta_config.json"), "w") as config_file:
+        json.dump(config, config_file)
+    return plex_root, scanner_file
+
+
+def remove_plex_root(plex_root):
+    shutil.rmtree(plex_root, ignore_errors=True)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024 if sys.platform == "darwin" else 1024.0)
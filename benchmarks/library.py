@@ -0,0 +1,56 @@
+"""Synthetic TubeArchivist media libraries for the benchmarks."""
+
+import os
+
+LAYOUT_LEGACY = "legacy"
+LAYOUT_CURRENT = "current"
+LAYOUTS = (LAYOUT_LEGACY, LAYOUT_CURRENT)
+
+
+def channel_id(index):
+    return "UC{:022d}".format(index)
+
+
+def video_id(channel, index):
+    return "v{:04d}{:06d}".format(channel, index)
+
+
+def build_library(ta, root, channels, files_per_channel, layout):
+    """Create empty video files under `root` and register them with `ta`.
+
+    Legacy folders are named after the channel and files follow
+    `<date>_<ytid>_<title>.mp4`; current folders are named after the channel
+    ID and files are `<ytid>.mp4`. Returns `[(folder, [file paths])]`.
+    """
+    folders = []
+    for channel in range(channels):
+        chid = channel_id(channel)
+        name = "Channel {:04d}".format(channel)
+        ta.add_channel(chid, name)
+        folder = name if layout == LAYOUT_LEGACY else chid
+        path = os.path.join(root, folder)
+        os.makedirs(path)
+        files = []
+        for index in range(files_per_channel):
+            ytid = video_id(channel, index)
+            year = 2010 + index // 336 % 15
+            month = 1 + index // 28 % 12
+            day = 1 + index % 28
+            title = "Video {}".format(index)
+            ta.add_video(
+                ytid,
+                chid,
+                "{:04d}-{:02d}-{:02d}".format(year, month, day),
+                title,
+            )
+            if layout == LAYOUT_LEGACY:
+                filename = "{:04d}{:02d}{:02d}_{}_{}.mp4".format(
+                    year, month, day, ytid, title.replace(" ", "_")
+                )
+            else:
+                filename = "{}.mp4".format(ytid)
+            filename = os.path.join(path, filename)
+            open(filename, "wb").close()
+            files.append(filename)
+        folders.append((folder, files))
+    return folders
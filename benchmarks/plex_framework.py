@@ -0,0 +1,231 @@
+"""Lightweight fakes for the Plex framework globals used by the Agent.
+
+The Agent's `__init__.py` expects `Log`, `Prefs`, `Locale`, `Datetime`,
+`Agent`, `HTTP`, `Proxy`, `Core` and `MetadataSearchResult` to be injected
+by the Plex plug-in framework. `install()` provides them as builtins, and
+the classes below mimic the `media` and `metadata` trees passed to
+`Search()` and `Update()`.
+"""
+
+import datetime
+import os
+import sys
+import types
+
+try:
+    import builtins  # Python >= 3.0
+except ImportError:
+    import __builtin__ as builtins  # Python == 2.x
+
+DEFAULT_PREFS = {
+    "add_user_as_director": True,
+    "media_poster_source": "Channel",
+    "tubearchivist_api_key": "benchmark",
+    "tubearchivist_url": "",
+    "show_channel_id": True,
+    "tubearchivist_offline_mode": False,
+    "tubearchivist_snapshot_path": "",
+}
+
+
+class FakeLog(object):
+    """`Log(...)` and `Log.Info(...)` style logging, silent unless verbose."""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def write(self, level, message):
+        if self.verbose:
+            sys.stderr.write("{} {}\n".format(level, message))
+
+    def __call__(self, message, *args):
+        self.write("LOG", message)
+
+    def __getattr__(self, level):
+        return lambda message, *args: self.write(level.upper(), message)
+
+
+class FakePrefs(dict):
+    """Plex returns None for unknown preferences instead of raising."""
+
+    def __getitem__(self, key):
+        return dict.get(self, key)
+
+
+class FakeLanguage(object):
+    NoLanguage = "xn"
+    English = "en"
+
+    @staticmethod
+    def Match(language):
+        return language
+
+
+class FakeLocale(object):
+    Language = FakeLanguage
+
+
+class FakeDatetime(object):
+    @staticmethod
+    def ParseDate(value):
+        return datetime.datetime.strptime(value[:10], "%Y-%m-%d")
+
+
+class FakeAgent(object):
+    TV_Shows = object
+
+
+class FakeHTTP(object):
+    Headers = {}
+
+
+class FakeProxy(object):
+    @staticmethod
+    def Media(data, sort_order=None):
+        return ("Media", len(data), sort_order)
+
+    @staticmethod
+    def LocalFile(path, **kwargs):
+        return ("LocalFile", path)
+
+
+class FakeStorage(object):
+    @staticmethod
+    def load(filename):
+        with open(filename) as data:
+            return data.read()
+
+
+class FakeCore(object):
+    storage = FakeStorage
+
+
+class SearchResults(list):
+    def Append(self, result):
+        self.append(result)
+
+
+def install(prefs=None, verbose=False):
+    """Inject the framework globals, returning the `Prefs` object."""
+    settings = FakePrefs(DEFAULT_PREFS)
+    settings.update(prefs or {})
+    builtins.Log = FakeLog(verbose)
+    builtins.Prefs = settings
+    builtins.Locale = FakeLocale
+    builtins.Datetime = FakeDatetime
+    builtins.Agent = FakeAgent
+    builtins.HTTP = FakeHTTP
+    builtins.Proxy = FakeProxy
+    builtins.Core = FakeCore
+    builtins.MetadataSearchResult = dict
+    if not hasattr(builtins, "unicode"):  # Python >= 3.0
+        builtins.unicode = str
+    if "urllib2" not in sys.modules:
+        try:
+            import urllib2  # noqa: F401
+        except ImportError:  # Python >= 3.0
+            from urllib.parse import unquote
+
+            sys.modules["urllib2"] = types.ModuleType("urllib2")
+            sys.modules["urllib2"].unquote = unquote
+    return settings
+
+
+class AutoDict(dict):
+    """Plex metadata containers create children on first access."""
+
+    def __init__(self, factory):
+        dict.__init__(self)
+        self.factory = factory
+
+    def __missing__(self, key):
+        value = self[key] = self.factory()
+        return value
+
+
+class SubtitleSet(dict):
+    def validate_keys(self, keys):
+        for key in list(self.keys()):
+            if key not in keys:
+                del self[key]
+
+
+class MediaPart(object):
+    def __init__(self, filename):
+        self.file = filename
+        self.subtitles = AutoDict(SubtitleSet)
+
+
+class MediaItem(object):
+    def __init__(self, filename):
+        self.parts = [MediaPart(filename)]
+
+
+class MediaEpisode(object):
+    def __init__(self, filename):
+        self.items = [MediaItem(filename)]
+
+
+class MediaSeason(object):
+    def __init__(self):
+        self.episodes = {}
+
+
+class MediaShow(object):
+    def __init__(self, show, year=None):
+        self.show = show
+        self.filename = None
+        self.year = year
+        self.seasons = {}
+
+
+class MetadataEpisode(object):
+    def __init__(self):
+        self.title = None
+        self.summary = None
+        self.originally_available_at = None
+        self.thumbs = {}
+
+
+class MetadataSeason(object):
+    def __init__(self):
+        self.episodes = AutoDict(MetadataEpisode)
+
+
+class Role(object):
+    pass
+
+
+class Roles(list):
+    def new(self):
+        role = Role()
+        self.append(role)
+        return role
+
+    def clear(self):
+        del self[:]
+
+
+class MetadataShow(object):
+    def __init__(self, id):
+        self.id = id
+        self.title = None
+        self.summary = None
+        self.studio = None
+        self.posters = {}
+        self.art = {}
+        self.banners = {}
+        self.roles = Roles()
+        self.seasons = AutoDict(MetadataSeason)
+
+
+def build_media(show, folder, episodes_by_season):
+    """Build a `media` tree from `{season: [filename, ...]}`."""
+    media = MediaShow(show)
+    for season, filenames in episodes_by_season.items():
+        media.seasons[season] = MediaSeason()
+        for index, filename in enumerate(filenames):
+            media.seasons[season].episodes[str(index + 1)] = MediaEpisode(
+                os.path.join(folder, filename)
+            )
+    return media
@@ -0,0 +1,17 @@
+"""Stand-in for the Plex scanner `Media` module."""
+
+
+class Episode(object):
+    def __init__(self, show, season, episode, title, year):
+        self.show = show
+        self.season = season
+        self.episode = episode
+        self.title = title
+        self.year = year
+        self.released_at = None
+        self.parts = []
+
+    def __repr__(self):
+        return "<Episode {} S{}E{} {}>".format(
+            self.show, self.season, self.episode, self.title
+        )
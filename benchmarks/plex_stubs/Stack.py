@@ -0,0 +1,5 @@
+"""Stand-in for the Plex scanner `Stack` module."""
+
+
+def Scan(path, files, mediaList, subdirs):
+    pass
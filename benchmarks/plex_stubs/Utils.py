@@ -0,0 +1,7 @@
+"""Stand-in for the Plex scanner `Utils` module."""
+
+import os
+
+
+def SplitPath(path):
+    return [part for part in path.split(os.sep) if part]
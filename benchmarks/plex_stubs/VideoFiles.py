@@ -0,0 +1,9 @@
+"""Stand-in for the Plex scanner `VideoFiles` module."""
+
+
+def Scan(path, files, mediaList, subdirs):
+    pass
+
+
+def CleanName(name):
+    return name, None